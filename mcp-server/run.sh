@@ -17,6 +17,8 @@ ENABLE_TIMESCALEDB=$(bashio::config 'enable_timescaledb')
 LOG_LEVEL=$(bashio::config 'log_level')
 QUERY_TIMEOUT=$(bashio::config 'query_timeout')
 MAX_QUERY_DAYS=$(bashio::config 'max_query_days')
+PGBOUNCER=$(bashio::config 'pgbouncer')
+STATE_NOTIFICATIONS=$(bashio::config 'state_notifications')
 
 echo "📊 Database: ${PG_USER}@${PG_HOST}:${PG_PORT}/${PG_DATABASE}"
 echo "🔒 Read-only mode: ${READ_ONLY}"
@@ -35,21 +37,22 @@ export MCP_PORT="8099"
 export LOG_LEVEL="${LOG_LEVEL^^}"
 export MCP_QUERY_TIMEOUT="${QUERY_TIMEOUT}"
 export MCP_MAX_QUERY_DAYS="${MAX_QUERY_DAYS}"
+export MCP_PGBOUNCER="${PGBOUNCER}"
+export MCP_STATE_NOTIFY="${STATE_NOTIFICATIONS}"
 
 # Quick database connectivity test
 echo "🔍 Testing database connection..."
 timeout 10 python3 -c "
-import psycopg2
+import asyncio
+import asyncpg
+
+async def probe():
+    # Connection settings come from the PG* variables exported above
+    conn = await asyncpg.connect(timeout=5)
+    await conn.close()
+
 try:
-    conn = psycopg2.connect(
-        host='${PG_HOST}',
-        port=${PG_PORT},
-        database='${PG_DATABASE}',
-        user='${PG_USER}',
-        password='${PG_PASSWORD}',
-        connect_timeout=5
-    )
-    conn.close()
+    asyncio.run(probe())
     print('✅ Database connection successful')
 except Exception as e:
     print(f'⚠️  Database connection failed: {e}')
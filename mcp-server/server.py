@@ -4,18 +4,27 @@ Model Context Protocol server for Home Assistant historical data
 Version: 6.4
 """
 import os
+import re
+import math
+import importlib.util
+import functools
+import inspect
 import asyncio
 import sys
 import logging
-import json
+import time
 import uuid
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from typing import Optional, Dict, Any, List, Union
 import asyncpg
+import msgpack
+import orjson
 from asyncpg.pool import Pool
 
 # FastAPI for SSE transport
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import Body, FastAPI, HTTPException, Request
+from fastapi.middleware.gzip import GZipMiddleware
+from pydantic import BaseModel, ConfigDict
 from fastapi.responses import StreamingResponse, HTMLResponse, Response
 import uvicorn
 
@@ -41,23 +50,549 @@ READ_ONLY = os.getenv("MCP_READ_ONLY", "true").lower() == "true"
 ENABLE_TIMESCALE = os.getenv("MCP_ENABLE_TIMESCALEDB", "false").lower() == "true"
 QUERY_TIMEOUT = int(os.getenv("MCP_QUERY_TIMEOUT", "30"))
 MAX_QUERY_DAYS = int(os.getenv("MCP_MAX_QUERY_DAYS", "90"))
+PGBOUNCER = os.getenv("MCP_PGBOUNCER", "false").lower() == "true"
+STATE_NOTIFY = os.getenv("MCP_STATE_NOTIFY", "false").lower() == "true"
 MCP_PORT = int(os.getenv("MCP_PORT", "8099"))
 
+# Upper bound on rows returned by a single raw history/statistics query
+MAX_RAW_ROWS = 5000
+# Rows fetched per cursor round trip (and per chunk) by /history/stream
+STREAM_FETCH_SIZE = 5000
+# Upper bound on entities in one get_history_batch call
+MAX_BATCH_ENTITIES = 20
+# Seconds a list_entities result is reused; the meta tables rarely change
+ENTITY_CACHE_TTL = 60
+# Upper bound on cached list_entities results; keys are chosen by clients
+ENTITY_CACHE_SIZE = 32
+
 logger.info(f"📝 Log level: {logging.getLogger().level}")
 logger.info(f"🗄️ Database: {DB_USER}@{DB_HOST}:{DB_PORT}/{DB_NAME}")
 logger.info(f"🔒 Read-only: {READ_ONLY}")
 logger.info(f"⏱️ Query timeout: {QUERY_TIMEOUT}s")
 logger.info(f"📅 Max query days: {MAX_QUERY_DAYS}")
+logger.info(f"🔀 PgBouncer mode: {PGBOUNCER}")
+logger.info(f"📣 State notifications: {STATE_NOTIFY}")
+
+# =============================================================================
+# SQL Statements
+# =============================================================================
+# Every query is a fixed string so repeated calls send identical text and
+# asyncpg's per-connection statement cache reuses the server-side plan.
+
+ENTITY_META_SQL = """
+    SELECT metadata_id, entity_id 
+    FROM states_meta 
+    WHERE entity_id = $1
+"""
+
+# States that PostgreSQL can cast to a number (same test on both sides)
+_NUMERIC_REGEX = r"^-?[0-9]+(\.[0-9]+)?$"
+_NUMERIC_PATTERN = f"'{_NUMERIC_REGEX}'"
+_is_numeric = re.compile(_NUMERIC_REGEX).match
+
+# last_updated_ts is epoch seconds: bind the bounds as doubles so the
+# range and LIMIT are served by the (metadata_id, last_updated_ts) index.
+# Numeric states are filtered and cast server-side and arrive as floats.
+HISTORY_RAW_SQL = f"""
+    SELECT 
+        to_timestamp(last_updated_ts) as timestamp,
+        state::double precision as value
+    FROM states
+    WHERE metadata_id = $1
+        AND last_updated_ts >= $2
+        AND last_updated_ts < $3
+        AND state ~ {_NUMERIC_PATTERN}
+    ORDER BY last_updated_ts
+    LIMIT $4
+"""
+
+# Raw states of any kind (e.g. 'on'/'off'), for non-numeric entities
+HISTORY_RAW_STATE_SQL = """
+    SELECT 
+        to_timestamp(last_updated_ts) as timestamp,
+        state as value
+    FROM states
+    WHERE metadata_id = $1
+        AND last_updated_ts >= $2
+        AND last_updated_ts < $3
+        AND state NOT IN ('unknown', 'unavailable', '')
+    ORDER BY last_updated_ts
+    LIMIT $4
+"""
+
+# Timestamps rendered by PostgreSQL exactly as orjson renders datetimes: RFC 3339
+# with a "Z" suffix, and six fractional digits only when there are microseconds
+_UTC_TS = "(to_timestamp(last_updated_ts) AT TIME ZONE 'UTC')"
+_UTC_TIMESTAMP = (
+    f"""to_char({_UTC_TS}, 'YYYY-MM-DD"T"HH24:MI:SS')"""
+    f""" || CASE to_char({_UTC_TS}, 'US') WHEN '000000' THEN '' ELSE to_char({_UTC_TS}, '.US') END || 'Z'"""
+)
+
+# The raw numeric series rendered as one JSON array by PostgreSQL, for HTTP
+# clients; metadata_id is NULL for an unknown entity
+HISTORY_RAW_JSON_SQL = f"""
+    WITH meta AS (
+        SELECT metadata_id FROM states_meta WHERE entity_id = $1 LIMIT 1
+    )
+    SELECT 
+        (SELECT metadata_id FROM meta) as metadata_id,
+        count(*) as count,
+        coalesce(json_agg(json_build_object(
+            't', {_UTC_TIMESTAMP},
+            'v', value
+        ) ORDER BY last_updated_ts), '[]') as series
+    FROM (
+        SELECT last_updated_ts, state::double precision as value
+        FROM states
+        WHERE metadata_id = (SELECT metadata_id FROM meta)
+            AND last_updated_ts >= $2
+            AND last_updated_ts < $3
+            AND state ~ {_NUMERIC_PATTERN}
+        ORDER BY last_updated_ts
+        LIMIT $4
+    ) raw
+"""
+
+# All recorded states of an entity for COPY ... TO STDOUT exports
+HISTORY_EXPORT_SQL = f"""
+    SELECT 
+        {_UTC_TIMESTAMP} as timestamp,
+        state
+    FROM states
+    WHERE metadata_id = $1
+        AND last_updated_ts >= $2
+        AND last_updated_ts < $3
+        AND state NOT IN ('unknown', 'unavailable', '')
+    ORDER BY last_updated_ts
+"""
+
+# Buckets are aligned on the epoch; the bucket width in seconds is bound as $1
+_HISTORY_BUCKET_SQL = """
+    SELECT 
+        to_timestamp(floor(last_updated_ts / $1) * $1) as timestamp,
+        {value} as value
+    FROM states
+    WHERE metadata_id = $2
+        AND last_updated_ts >= $3
+        AND last_updated_ts < $4
+        AND state NOT IN ('unknown', 'unavailable', '')
+    GROUP BY 1
+    ORDER BY 1
+"""
+
+_NUMERIC_STATE = f"CASE WHEN state ~ {_NUMERIC_PATTERN} THEN state::double precision ELSE NULL END"
+
+HISTORY_AGG_SQL = {
+    "mean": _HISTORY_BUCKET_SQL.format(value=f"AVG({_NUMERIC_STATE})"),
+    "sum": _HISTORY_BUCKET_SQL.format(value=f"SUM({_NUMERIC_STATE})"),
+    "min": _HISTORY_BUCKET_SQL.format(value=f"MIN({_NUMERIC_STATE})"),
+    "max": _HISTORY_BUCKET_SQL.format(value=f"MAX({_NUMERIC_STATE})"),
+    "first": _HISTORY_BUCKET_SQL.format(value=f"(array_agg({_NUMERIC_STATE} ORDER BY last_updated_ts ASC))[1]"),
+    "last": _HISTORY_BUCKET_SQL.format(value=f"(array_agg({_NUMERIC_STATE} ORDER BY last_updated_ts DESC))[1]"),
+}
+
+# Aggregation bucket widths in seconds
+HISTORY_INTERVALS = {
+    "5m": 300, "15m": 900, "30m": 1800,
+    "1h": 3600, "6h": 21600, "1d": 86400
+}
+# interval="auto" sizes the buckets so any range comes back as about this many points
+AUTO_INTERVAL_POINTS = 200
+
+STATISTICS_META_SQL = """
+    SELECT id, statistic_id, source, unit_of_measurement
+    FROM statistics_meta
+    WHERE statistic_id = $1
+"""
+
+_STATISTICS_SQL = """
+    SELECT 
+        to_timestamp(start_ts) as timestamp,
+        mean, min, max, sum
+    FROM {table}
+    WHERE metadata_id = $1
+        AND start_ts >= $2
+        AND start_ts < $3
+    ORDER BY start_ts
+    LIMIT $4
+"""
+
+STATISTICS_SQL = {
+    table: _STATISTICS_SQL.format(table=table)
+    for table in ("statistics", "statistics_short_term")
+}
+
+# Entities seen in the last week, most recent first; keyed by whether an
+# entity_id LIKE pattern is bound as $3
+_ENTITIES_SQL = """
+    SELECT DISTINCT
+        sm.entity_id,
+        MAX(s.last_updated_ts) as last_seen_ts
+    FROM states_meta sm
+    LEFT JOIN states s ON s.metadata_id = sm.metadata_id
+        AND s.last_updated_ts > $1
+    WHERE 1=1 {filter}
+    GROUP BY sm.entity_id
+    HAVING MAX(s.last_updated_ts) IS NOT NULL
+    ORDER BY MAX(s.last_updated_ts) DESC
+    LIMIT $2
+"""
+
+ENTITIES_SQL = {
+    False: _ENTITIES_SQL.format(filter=""),
+    True: _ENTITIES_SQL.format(filter="AND sm.entity_id LIKE $3"),
+}
+
+# Long-term statistics available; keyed by whether a LIKE pattern is bound as $2
+_STATISTICS_LIST_SQL = """
+    SELECT 
+        statistic_id,
+        source,
+        unit_of_measurement
+    FROM statistics_meta
+    {filter}
+    ORDER BY statistic_id
+    LIMIT $1
+"""
+
+STATISTICS_LIST_SQL = {
+    False: _STATISTICS_LIST_SQL.format(filter=""),
+    True: _STATISTICS_LIST_SQL.format(filter="WHERE statistic_id LIKE $2"),
+}
+
+HEALTH_PROBE_SQL = """
+    SELECT version(), EXISTS(SELECT 1 FROM pg_extension WHERE extname = 'timescaledb')
+"""
 
 # Global database pool
 db_pool: Optional[Pool] = None
 
+# Timestamps leave the database as timezone-aware datetimes; orjson renders
+# them as RFC 3339 with a "Z" suffix without a per-row isoformat() call
+ORJSON_OPTIONS = orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z
+
+def dumps(obj: Any, indent: bool = False) -> str:
+    """Serialize a tool result to JSON text"""
+    option = ORJSON_OPTIONS | orjson.OPT_INDENT_2 if indent else ORJSON_OPTIONS
+    return orjson.dumps(obj, option=option).decode()
+
+def sse_frame(event: Dict[str, Any]) -> bytes:
+    """Encode one SSE data frame"""
+    return b"data: " + orjson.dumps(event, option=ORJSON_OPTIONS) + b"\n\n"
+
+class OrjsonResponse(Response):
+    """JSON response rendered straight from dicts by orjson, skipping jsonable_encoder"""
+    media_type = "application/json"
+    
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=ORJSON_OPTIONS)
+
+STATISTICS_FIELDS = ("mean", "min", "max", "sum")
+
+@functools.lru_cache(maxsize=1024)
+def _parse_iso(value: Union[str, datetime]) -> datetime:
+    """Parse an ISO 8601 timestamp ('Z' suffix allowed); datetimes pass through.
+    Bounds without an offset are UTC, so every result is aware and comparable.
+    Memoized since clients repeat the same range bounds and datetimes are immutable."""
+    if not isinstance(value, datetime):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+def round_series(series: List[Dict[str, Any]], precision: Optional[int], fields=("v",)) -> List[Dict[str, Any]]:
+    """Round the float fields of a series in place; no-op without a precision"""
+    if precision is not None:
+        precision = int(precision)
+        for point in series:
+            for field in fields:
+                value = point.get(field)
+                if isinstance(value, float):
+                    point[field] = round(value, precision)
+    return series
+
+def epoch_ms_series(series: List[Dict[str, Any]], time_format: str = "iso") -> List[Dict[str, Any]]:
+    """Replace the datetimes of a series with epoch milliseconds in place for time_format='epoch_ms'"""
+    if time_format == "epoch_ms":
+        for point in series:
+            point["t"] = int(point["t"].timestamp() * 1000)
+    return series
+
+def entity_not_found(entity_id: str) -> Dict[str, Any]:
+    """History result for an entity the recorder does not know"""
+    return {
+        "entity_id": entity_id,
+        "error": f"Entity '{entity_id}' not found in database",
+        "series": [],
+        "suggestion": "Use list_entities tool to see available entities"
+    }
+
+# Mock bucket widths in hours
+MOCK_INTERVAL_HOURS = {
+    "5m": 1/12, "15m": 0.25, "30m": 0.5,
+    "1h": 1, "6h": 6, "1d": 24
+}
+
+# Limit on mock series length
+MOCK_MAX_POINTS = 1000
+# Mock values depend only on the point index, so one small table serves every range
+MOCK_VALUES = tuple(round(20.0 + i * 0.1 + (i * 37 % 10) - 5, 2) for i in range(MOCK_MAX_POINTS))
+
+# Queries currently running, keyed by method name and bound arguments
+_inflight: Dict[tuple, asyncio.Future] = {}
+
+def single_flight(method):
+    """Let concurrent identical calls of a read-only query method share one execution"""
+    signature = inspect.signature(method)
+    
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        bound = signature.bind(self, *args, **kwargs)
+        bound.apply_defaults()
+        key = (method.__name__, *list(bound.arguments.items())[1:])
+        try:
+            task = _inflight.get(key)
+        except TypeError:
+            return await method(self, *args, **kwargs)  # Unhashable arguments; just run it
+        
+        if task is None:
+            task = _inflight[key] = asyncio.ensure_future(method(self, *args, **kwargs))
+            task.add_done_callback(lambda _: _inflight.pop(key, None))
+        # A caller that goes away must not cancel the query for the others
+        return await asyncio.shield(task)
+    
+    return wrapper
+
 # FastAPI app
-app = FastAPI(title="Home Assistant MCP Server", version="6.2")
+app = FastAPI(title="Home Assistant MCP Server", version="6.2", default_response_class=OrjsonResponse)
+
+class CompressionMiddleware(GZipMiddleware):
+    """GZip for regular responses; the SSE stream must reach clients frame by frame"""
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] == "/sse":
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+app.add_middleware(CompressionMiddleware, minimum_size=1024)
 
 # Global MCP server instance
 mcp_server_instance = None
-connected_clients = set()
+# Connected SSE clients, each with the queue its stream is fed from
+connected_clients: Dict[str, asyncio.Queue] = {}
+heartbeat_task: Optional[asyncio.Task] = None
+# Last database probe result, refreshed by db_health_monitor()
+db_health: Dict[str, Any] = {"status": "disconnected", "info": None}
+health_task: Optional[asyncio.Task] = None
+# Pool connection LISTENing for state changes when notifications are enabled
+notify_conn = None
+
+SSE_PING_INTERVAL = 30
+DB_HEALTH_INTERVAL = 10
+# Channel the optional states trigger (see DOCS.md) notifies on
+STATE_NOTIFY_CHANNEL = "ha_state_change"
+
+# =============================================================================
+# MCP Tool Definitions
+# =============================================================================
+# Built once at import; HAMCPServer instances share them
+
+# Query options shared by get_history and get_history_batch
+HISTORY_OPTIONS_SCHEMA = {
+    "interval": {
+        "type": "string",
+        "enum": ["raw", "auto", "5m", "15m", "30m", "1h", "6h", "1d"],
+        "description": f"Time interval for aggregation ('auto' picks buckets for about {AUTO_INTERVAL_POINTS} points)",
+        "default": "1h"
+    },
+    "aggregation": {
+        "type": "string",
+        "enum": ["mean", "min", "max", "sum", "last", "first"],
+        "description": "Aggregation method",
+        "default": "mean"
+    },
+    "limit": {
+        "type": "integer",
+        "description": "Maximum number of raw data points to return",
+        "default": MAX_RAW_ROWS,
+        "minimum": 1,
+        "maximum": MAX_RAW_ROWS
+    },
+    "numeric": {
+        "type": "boolean",
+        "description": (
+            "Return only numeric states as numbers (raw interval); "
+            "set false to include text states such as 'on'/'off'"
+        ),
+        "default": True
+    },
+    "precision": {
+        "type": "integer",
+        "description": "Round values to this many decimal places (smaller responses for plotting)",
+        "minimum": 0,
+        "maximum": 10
+    },
+    "time_format": {
+        "type": "string",
+        "enum": ["iso", "epoch_ms"],
+        "description": "Timestamps as ISO 8601 strings or as integer epoch milliseconds",
+        "default": "iso"
+    }
+}
+
+MCP_TOOLS: List[types.Tool] = [
+    types.Tool(
+        name="get_history",
+        description="Query historical state data from Home Assistant recorder",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "entity_id": {
+                    "type": "string",
+                    "description": "The entity to query (e.g., 'sensor.temperature')"
+                },
+                "start": {
+                    "type": "string",
+                    "description": "Start datetime in ISO format"
+                },
+                "end": {
+                    "type": "string",
+                    "description": "End datetime in ISO format"
+                },
+                **HISTORY_OPTIONS_SCHEMA
+            },
+            "required": ["entity_id", "start", "end"]
+        }
+    ),
+    types.Tool(
+        name="get_history_batch",
+        description="Query historical state data of several entities over the same time range in one call",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "entity_ids": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "description": "The entities to query (e.g., ['sensor.temperature', 'sensor.humidity'])",
+                    "minItems": 1,
+                    "maxItems": MAX_BATCH_ENTITIES
+                },
+                "start": {
+                    "type": "string",
+                    "description": "Start datetime in ISO format"
+                },
+                "end": {
+                    "type": "string",
+                    "description": "End datetime in ISO format"
+                },
+                **HISTORY_OPTIONS_SCHEMA
+            },
+            "required": ["entity_ids", "start", "end"]
+        }
+    ),
+    types.Tool(
+        name="get_statistics",
+        description="Query aggregated statistics data from Home Assistant",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "statistic_id": {
+                    "type": "string",
+                    "description": "The statistic to query"
+                },
+                "start": {
+                    "type": "string",
+                    "description": "Start datetime in ISO format"
+                },
+                "end": {
+                    "type": "string",
+                    "description": "End datetime in ISO format"
+                },
+                "period": {
+                    "type": "string",
+                    "enum": ["5minute", "hour", "day", "month"],
+                    "description": "Statistics period",
+                    "default": "hour"
+                },
+                "precision": {
+                    "type": "integer",
+                    "description": "Round values to this many decimal places (smaller responses for plotting)",
+                    "minimum": 0,
+                    "maximum": 10
+                },
+                "time_format": {
+                    "type": "string",
+                    "enum": ["iso", "epoch_ms"],
+                    "description": "Timestamps as ISO 8601 strings or as integer epoch milliseconds",
+                    "default": "iso"
+                }
+            },
+            "required": ["statistic_id", "start", "end"]
+        }
+    ),
+    types.Tool(
+        name="list_entities",
+        description="List available entities and statistics for querying",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "limit": {
+                    "type": "integer",
+                    "description": "Maximum number of items to return",
+                    "default": 100,
+                    "minimum": 1,
+                    "maximum": 500
+                },
+                "entity_type": {
+                    "type": "string",
+                    "description": "Filter by entity type (e.g., 'sensor', 'binary_sensor')",
+                    "default": None
+                }
+            }
+        }
+    ),
+    types.Tool(
+        name="health_check",
+        description="Check server and database health status",
+        inputSchema={
+            "type": "object",
+            "properties": {}
+        }
+    )
+]
+
+# The tool list never changes, so every SSE client gets the same frame
+TOOLS_LIST_FRAME = sse_frame({
+    "jsonrpc": "2.0", 
+    "method": "tools/list",
+    "result": {
+        "tools": [
+            {
+                "name": tool.name,
+                "description": tool.description,
+                "inputSchema": tool.inputSchema
+            }
+            for tool in MCP_TOOLS
+        ]
+    }
+})
+
+# First frame of every SSE session; constant for the lifetime of the process
+INIT_FRAME = sse_frame({
+    "jsonrpc": "2.0",
+    "method": "notifications/initialized",
+    "params": {
+        "protocolVersion": "2024-11-05",
+        "capabilities": {
+            "tools": {}
+        },
+        "serverInfo": {
+            "name": "ha-mcp-server",
+            "version": "6.4"
+        }
+    }
+})
 
 class HAMCPServer:
     """Home Assistant MCP Server Implementation"""
@@ -65,104 +600,15 @@ class HAMCPServer:
     def __init__(self):
         self.server = Server("ha-mcp-server")
         self.tools = []
+        # (limit, entity_type) -> (expires_at, result) for list_entities, oldest first
+        self._entities_cache: Dict[tuple, tuple] = {}
         self._register_handlers()
         self._setup_tools()
     
     def _setup_tools(self):
         """Setup the tool definitions"""
-        self.tools = [
-            types.Tool(
-                name="get_history",
-                description="Query historical state data from Home Assistant recorder",
-                inputSchema={
-                    "type": "object",
-                    "properties": {
-                        "entity_id": {
-                            "type": "string",
-                            "description": "The entity to query (e.g., 'sensor.temperature')"
-                        },
-                        "start": {
-                            "type": "string",
-                            "description": "Start datetime in ISO format"
-                        },
-                        "end": {
-                            "type": "string",
-                            "description": "End datetime in ISO format"
-                        },
-                        "interval": {
-                            "type": "string",
-                            "enum": ["raw", "5m", "15m", "30m", "1h", "6h", "1d"],
-                            "description": "Time interval for aggregation",
-                            "default": "1h"
-                        },
-                        "aggregation": {
-                            "type": "string",
-                            "enum": ["mean", "min", "max", "sum", "last", "first"],
-                            "description": "Aggregation method",
-                            "default": "mean"
-                        }
-                    },
-                    "required": ["entity_id", "start", "end"]
-                }
-            ),
-            types.Tool(
-                name="get_statistics",
-                description="Query aggregated statistics data from Home Assistant",
-                inputSchema={
-                    "type": "object",
-                    "properties": {
-                        "statistic_id": {
-                            "type": "string",
-                            "description": "The statistic to query"
-                        },
-                        "start": {
-                            "type": "string",
-                            "description": "Start datetime in ISO format"
-                        },
-                        "end": {
-                            "type": "string",
-                            "description": "End datetime in ISO format"
-                        },
-                        "period": {
-                            "type": "string",
-                            "enum": ["5minute", "hour", "day", "month"],
-                            "description": "Statistics period",
-                            "default": "hour"
-                        }
-                    },
-                    "required": ["statistic_id", "start", "end"]
-                }
-            ),
-            types.Tool(
-                name="list_entities",
-                description="List available entities and statistics for querying",
-                inputSchema={
-                    "type": "object",
-                    "properties": {
-                        "limit": {
-                            "type": "integer",
-                            "description": "Maximum number of items to return",
-                            "default": 100,
-                            "minimum": 1,
-                            "maximum": 500
-                        },
-                        "entity_type": {
-                            "type": "string",
-                            "description": "Filter by entity type (e.g., 'sensor', 'binary_sensor')",
-                            "default": None
-                        }
-                    }
-                }
-            ),
-            types.Tool(
-                name="health_check",
-                description="Check server and database health status",
-                inputSchema={
-                    "type": "object",
-                    "properties": {}
-                }
-            )
-        ]
+        self.tools = MCP_TOOLS
+        self.tools_frame = TOOLS_LIST_FRAME
     
     def _register_handlers(self):
         """Register all MCP handlers"""
@@ -178,46 +624,57 @@ class HAMCPServer:
             try:
                 logger.info(f"🔧 Tool called: {name} with args: {arguments}")
                 
-                if name == "get_history":
-                    result = await self.get_history(**arguments)
-                elif name == "get_statistics":
-                    result = await self.get_statistics(**arguments)
-                elif name == "list_entities":
-                    result = await self.list_entities(**arguments)
-                elif name == "health_check":
-                    result = await self.health_check()
-                else:
-                    raise ValueError(f"Unknown tool: {name}")
+                result = await self.dispatch_tool(name, arguments)
                 
                 logger.info(f"✅ Tool {name} completed successfully")
                 
                 return [types.TextContent(
                     type="text",
-                    text=json.dumps(result, indent=2)
+                    text=dumps(result, indent=True)
                 )]
             
             except Exception as e:
                 logger.error(f"❌ Error executing tool {name}: {e}")
                 return [types.TextContent(
                     type="text", 
-                    text=json.dumps({"error": str(e), "tool": name}, indent=2)
+                    text=dumps({"error": str(e), "tool": name}, indent=True)
                 )]
     
+    async def dispatch_tool(self, name: str, arguments: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Run a tool by name"""
+        arguments = arguments or {}
+        if name == "get_history":
+            return await self.get_history(**arguments)
+        elif name == "get_history_batch":
+            return await self.get_history_batch(**arguments)
+        elif name == "get_statistics":
+            return await self.get_statistics(**arguments)
+        elif name == "list_entities":
+            return await self.list_entities(**arguments)
+        elif name == "health_check":
+            return await self.health_check()
+        raise ValueError(f"Unknown tool: {name}")
+    
+    @single_flight
     async def get_history(
         self, 
         entity_id: str,
-        start: str, 
-        end: str,
+        start: Union[str, datetime], 
+        end: Union[str, datetime],
         interval: str = "1h",
-        aggregation: str = "mean"
+        aggregation: str = "mean",
+        limit: int = MAX_RAW_ROWS,
+        numeric: bool = True,
+        precision: Optional[int] = None,
+        time_format: str = "iso"
     ) -> Dict[str, Any]:
         """Query historical state data"""
         logger.info(f"📊 get_history: {entity_id} from {start} to {end} (interval: {interval}, agg: {aggregation})")
         
         # Validate date range
         try:
-            start_dt = datetime.fromisoformat(start.replace("Z", "+00:00"))
-            end_dt = datetime.fromisoformat(end.replace("Z", "+00:00"))
+            start_dt = _parse_iso(start)
+            end_dt = _parse_iso(end)
             
             if (end_dt - start_dt).days > MAX_QUERY_DAYS:
                 raise ValueError(f"Query range exceeds {MAX_QUERY_DAYS} days")
@@ -227,9 +684,10 @@ class HAMCPServer:
         # Use mock data if no database connection
         if not db_pool:
             logger.warning("🎭 Using mock data - no database connection")
+            series = round_series(self.generate_mock_series(start_dt, end_dt, interval), precision)
             return {
                 "entity_id": entity_id,
-                "series": self.generate_mock_series(start, end, interval),
+                "series": epoch_ms_series(series, time_format),
                 "interval": interval,
                 "aggregation": aggregation,
                 "mock_data": True,
@@ -239,127 +697,61 @@ class HAMCPServer:
         try:
             async with db_pool.acquire() as conn:
                 # Get entity metadata
-                entity_meta = await conn.fetchrow("""
-                    SELECT metadata_id, entity_id 
-                    FROM states_meta 
-                    WHERE entity_id = $1
-                """, entity_id)
+                entity_meta = await conn.fetchrow(ENTITY_META_SQL, entity_id)
                 
                 if not entity_meta:
-                    return {
-                        "entity_id": entity_id,
-                        "error": f"Entity '{entity_id}' not found in database",
-                        "series": [],
-                        "suggestion": "Use list_entities tool to see available entities"
-                    }
+                    return entity_not_found(entity_id)
                 
                 # Handle raw data requests
                 if interval == "raw":
-                    query = """
-                        SELECT 
-                            last_updated_ts as timestamp,
-                            state
-                        FROM states
-                        WHERE metadata_id = $1
-                            AND last_updated_ts >= $2
-                            AND last_updated_ts < $3
-                            AND state NOT IN ('unknown', 'unavailable', '')
-                        ORDER BY last_updated_ts
-                        LIMIT 5000
-                    """
+                    query = HISTORY_RAW_SQL if numeric else HISTORY_RAW_STATE_SQL
                     rows = await conn.fetch(query, entity_meta['metadata_id'], 
-                                           start_dt.timestamp(), end_dt.timestamp())
+                                           start_dt.timestamp(), end_dt.timestamp(),
+                                           max(1, min(int(limit), MAX_RAW_ROWS)))
                     
-                    series = []
-                    for row in rows:
-                        try:
-                            # Try to convert to float, fallback to string
-                            value = float(row['state']) if row['state'].replace('.','').replace('-','').isdigit() else row['state']
-                            series.append({
-                                "t": datetime.fromtimestamp(row['timestamp']).isoformat() + "Z",
-                                "v": value
-                            })
-                        except (ValueError, AttributeError):
-                            continue
+                    if numeric:
+                        series = [{"t": timestamp, "v": value} for timestamp, value in rows]
+                    else:
+                        # Numbers as floats, anything else as the state string
+                        series = [
+                            {"t": timestamp, "v": float(state) if _is_numeric(state) else state}
+                            for timestamp, state in rows
+                        ]
                 else:
                     # Aggregated query
-                    interval_sql = {
-                        "5m": "5 minutes", "15m": "15 minutes", "30m": "30 minutes",
-                        "1h": "1 hour", "6h": "6 hours", "1d": "1 day"
-                    }.get(interval, "1 hour")
-                    
-                    # Build aggregation function
-                    if aggregation == "mean":
-                        agg_func = "AVG"
-                    elif aggregation == "sum": 
-                        agg_func = "SUM"
-                    elif aggregation == "min":
-                        agg_func = "MIN"
-                    elif aggregation == "max":
-                        agg_func = "MAX"
-                    elif aggregation == "last":
-                        agg_func = "LAST"
-                    elif aggregation == "first":
-                        agg_func = "FIRST"
+                    if interval == "auto":
+                        bucket_seconds = max(60, math.ceil((end_dt - start_dt).total_seconds() / AUTO_INTERVAL_POINTS))
                     else:
-                        agg_func = "AVG"
+                        bucket_seconds = HISTORY_INTERVALS.get(interval, 3600)
+                    query = HISTORY_AGG_SQL.get(aggregation, HISTORY_AGG_SQL["mean"])
                     
-                    if agg_func in ["LAST", "FIRST"]:
-                        order = "DESC" if agg_func == "LAST" else "ASC"
-                        query = f"""
-                            SELECT 
-                                date_trunc($1, to_timestamp(last_updated_ts)) as timestamp,
-                                (array_agg(
-                                    CASE WHEN state ~ '^-?[0-9]+\.?[0-9]*$' 
-                                         THEN state::numeric 
-                                         ELSE NULL END 
-                                    ORDER BY last_updated_ts {order}
-                                ))[1] as value
-                            FROM states
-                            WHERE metadata_id = $2
-                                AND last_updated_ts >= $3
-                                AND last_updated_ts < $4
-                                AND state NOT IN ('unknown', 'unavailable', '')
-                            GROUP BY date_trunc($1, to_timestamp(last_updated_ts))
-                            ORDER BY timestamp
-                        """
-                    else:
-                        query = f"""
-                            SELECT 
-                                date_trunc($1, to_timestamp(last_updated_ts)) as timestamp,
-                                {agg_func}(CASE 
-                                    WHEN state ~ '^-?[0-9]+\.?[0-9]*$' THEN state::numeric 
-                                    ELSE NULL 
-                                END) as value
-                            FROM states
-                            WHERE metadata_id = $2
-                                AND last_updated_ts >= $3
-                                AND last_updated_ts < $4
-                                AND state NOT IN ('unknown', 'unavailable', '')
-                            GROUP BY date_trunc($1, to_timestamp(last_updated_ts))
-                            ORDER BY timestamp
-                        """
-                    
-                    rows = await conn.fetch(query, interval_sql, entity_meta['metadata_id'], 
+                    rows = await conn.fetch(query, bucket_seconds, entity_meta['metadata_id'], 
                                            start_dt.timestamp(), end_dt.timestamp())
                     
-                    series = [{
-                        "t": row['timestamp'].isoformat() + "Z",
-                        "v": float(row['value']) if row['value'] is not None else None
-                    } for row in rows if row.get('value') is not None]
+                    # Aggregates of double precision come back as floats already
+                    series = [
+                        {"t": timestamp, "v": value}
+                        for timestamp, value in rows if value is not None
+                    ]
                 
-                return {
+                round_series(series, precision)
+                epoch_ms_series(series, time_format)
+                
+                result = {
                     "entity_id": entity_id,
                     "series": series,
                     "count": len(series),
                     "interval": interval,
                     "aggregation": aggregation,
-                    "query_time": datetime.utcnow().isoformat() + "Z",
+                    "query_time": datetime.utcnow(),
                     "time_range": {
-                        "start": start,
-                        "end": end
+                        "start": start_dt,
+                        "end": end_dt
                     }
                 }
+                if interval == "auto":
+                    result["bucket_seconds"] = bucket_seconds
+                return result
                 
         except Exception as e:
             logger.error(f"💥 Database error in get_history: {e}")
@@ -369,25 +761,111 @@ class HAMCPServer:
                 "series": []
             }
     
+    async def get_history_batch(
+        self,
+        entity_ids: List[str],
+        start: Union[str, datetime],
+        end: Union[str, datetime],
+        **options
+    ) -> Dict[str, Any]:
+        """Query the history of several entities over one time range concurrently"""
+        if isinstance(entity_ids, list) and all(isinstance(entity_id, str) for entity_id in entity_ids):
+            entity_ids = list(dict.fromkeys(entity_ids))  # Drop duplicates, keep order
+        else:
+            entity_ids = []  # A lone string would otherwise become one entity per character
+        if not entity_ids or len(entity_ids) > MAX_BATCH_ENTITIES:
+            return {"error": f"entity_ids must list 1 to {MAX_BATCH_ENTITIES} entities"}
+        
+        logger.info(f"📊 get_history_batch: {len(entity_ids)} entities from {start} to {end}")
+        
+        try:
+            start_dt = _parse_iso(start)
+            end_dt = _parse_iso(end)
+        except Exception as e:
+            return {"error": f"Invalid date format: {e}"}
+        
+        # Each entity runs on its own pool connection; the pool size bounds concurrency
+        results = await asyncio.gather(*(
+            self.get_history(entity_id, start_dt, end_dt, **options)
+            for entity_id in entity_ids
+        ))
+        
+        return {
+            "results": dict(zip(entity_ids, results)),
+            "entity_count": len(entity_ids),
+            "time_range": {
+                "start": start_dt,
+                "end": end_dt
+            }
+        }
+    
+    async def get_history_json(
+        self,
+        entity_id: str,
+        start_dt: datetime,
+        end_dt: datetime,
+        limit: int = MAX_RAW_ROWS,
+        aggregation: str = "mean"
+    ) -> Optional[bytes]:
+        """Raw numeric history as the JSON get_history would return, or None to leave
+        mock data and range errors to get_history"""
+        start_dt, end_dt = _parse_iso(start_dt), _parse_iso(end_dt)  # Aware, so comparable
+        if not db_pool or (end_dt - start_dt).days > MAX_QUERY_DAYS:
+            return None
+        
+        try:
+            async with db_pool.acquire() as conn:
+                row = await conn.fetchrow(HISTORY_RAW_JSON_SQL, entity_id,
+                                          start_dt.timestamp(), end_dt.timestamp(),
+                                          max(1, min(int(limit), MAX_RAW_ROWS)))
+        except Exception as e:
+            logger.error(f"💥 Database error in get_history_json: {e}")
+            return orjson.dumps({
+                "entity_id": entity_id,
+                "error": f"Database query failed: {str(e)}",
+                "series": []
+            })
+        
+        if row['metadata_id'] is None:
+            return orjson.dumps(entity_not_found(entity_id))
+        
+        # Same keys in the same order as get_history; the database-built
+        # series array is spliced in without decoding it
+        head = orjson.dumps({"entity_id": entity_id})[:-1]
+        tail = orjson.dumps({
+            "count": row['count'],
+            "interval": "raw",
+            "aggregation": aggregation,
+            "query_time": datetime.utcnow(),
+            "time_range": {
+                "start": start_dt,
+                "end": end_dt
+            }
+        }, option=ORJSON_OPTIONS)[1:]
+        return head + b',"series":' + row['series'].encode() + b"," + tail
+    
+    @single_flight
     async def get_statistics(
         self,
         statistic_id: str,
-        start: str,
-        end: str,
-        period: str = "hour"
+        start: Union[str, datetime],
+        end: Union[str, datetime],
+        period: str = "hour",
+        precision: Optional[int] = None,
+        time_format: str = "iso"
     ) -> Dict[str, Any]:
         """Query aggregated statistics data"""
         logger.info(f"📈 get_statistics: {statistic_id} from {start} to {end} (period: {period})")
         
         try:
-            start_dt = datetime.fromisoformat(start.replace("Z", "+00:00"))
-            end_dt = datetime.fromisoformat(end.replace("Z", "+00:00"))
+            start_dt = _parse_iso(start)
+            end_dt = _parse_iso(end)
         except Exception as e:
             return {"error": f"Invalid date format: {e}"}
         
         if not db_pool:
             # Generate mock statistics
-            series = self.generate_mock_series(start, end, "1h" if period == "hour" else "1d")
+            series = self.generate_mock_series(start_dt, end_dt, "1h" if period == "hour" else "1d")
             for item in series:
                 value = item["v"]
                 item.update({
@@ -398,6 +876,9 @@ class HAMCPServer:
                 })
                 del item["v"]
             
+            round_series(series, precision, STATISTICS_FIELDS)
+            epoch_ms_series(series, time_format)
+            
             return {
                 "statistic_id": statistic_id,
                 "series": series,
@@ -409,11 +890,7 @@ class HAMCPServer:
         try:
             async with db_pool.acquire() as conn:
                 # Get statistics metadata
-                meta = await conn.fetchrow("""
-                    SELECT id, statistic_id, source, unit_of_measurement
-                    FROM statistics_meta
-                    WHERE statistic_id = $1
-                """, statistic_id)
+                meta = await conn.fetchrow(STATISTICS_META_SQL, statistic_id)
                 
                 if not meta:
                     return {
@@ -426,38 +903,23 @@ class HAMCPServer:
                 # Select appropriate table
                 table = "statistics_short_term" if period == "5minute" else "statistics"
                 
-                query = f"""
-                    SELECT 
-                        start_ts as timestamp,
-                        mean, min, max, sum
-                    FROM {table}
-                    WHERE metadata_id = $1
-                        AND start_ts >= $2
-                        AND start_ts < $3
-                    ORDER BY start_ts
-                    LIMIT 5000
-                """
-                
-                rows = await conn.fetch(query, meta['id'], 
-                                       start_dt.timestamp(), end_dt.timestamp())
+                rows = await conn.fetch(STATISTICS_SQL[table], meta['id'], 
+                                       start_dt.timestamp(), end_dt.timestamp(),
+                                       MAX_RAW_ROWS)
                 
+                # mean/min/max/sum are double precision columns and arrive as floats
                 series = []
-                for row in rows:
-                    item = {
-                        "t": datetime.fromtimestamp(row['timestamp']).isoformat() + "Z"
-                    }
-                    
-                    if row['mean'] is not None:
-                        item["mean"] = float(row['mean'])
-                    if row['min'] is not None:
-                        item["min"] = float(row['min'])
-                    if row['max'] is not None:
-                        item["max"] = float(row['max'])
-                    if row['sum'] is not None:
-                        item["sum"] = float(row['sum'])
-                    
+                for timestamp, *values in rows:
+                    item = {"t": timestamp}
+                    item.update(
+                        (field, value) for field, value in zip(STATISTICS_FIELDS, values)
+                        if value is not None
+                    )
                     series.append(item)
                 
+                round_series(series, precision, STATISTICS_FIELDS)
+                epoch_ms_series(series, time_format)
+                
                 return {
                     "statistic_id": statistic_id,
                     "source": meta['source'],
@@ -465,10 +927,10 @@ class HAMCPServer:
                     "series": series,
                     "count": len(series),
                     "period": period,
-                    "query_time": datetime.utcnow().isoformat() + "Z",
+                    "query_time": datetime.utcnow(),
                     "time_range": {
-                        "start": start,
-                        "end": end
+                        "start": start_dt,
+                        "end": end_dt
                     }
                 }
                 
@@ -481,17 +943,48 @@ class HAMCPServer:
             }
     
     async def list_entities(self, limit: int = 100, entity_type: Optional[str] = None) -> Dict[str, Any]:
-        """List available entities and statistics"""
+        """List available entities and statistics, cached for ENTITY_CACHE_TTL seconds"""
         logger.info(f"📝 list_entities: limit={limit}, type={entity_type}")
         
+        if not db_pool:
+            return await self._query_entities(limit, entity_type)
+        
+        key = (limit, entity_type)
+        cached = self._entities_cache.get(key)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        
+        # Concurrent misses for the same key share one query (single_flight);
+        # misses for other keys do not wait for it
+        result = await self._query_entities(limit, entity_type)
+        if "error" not in result:
+            self._cache_entities(key, result)
+        return result
+    
+    def _cache_entities(self, key: tuple, result: Dict[str, Any]) -> None:
+        """Store a list_entities result, dropping expired entries and the oldest beyond ENTITY_CACHE_SIZE"""
+        now = time.monotonic()
+        cache = self._entities_cache
+        for stale in [k for k, (expires_at, _) in cache.items() if expires_at <= now]:
+            del cache[stale]
+        
+        cache.pop(key, None)  # Re-insert as the newest entry
+        cache[key] = (now + ENTITY_CACHE_TTL, result)
+        while len(cache) > ENTITY_CACHE_SIZE:
+            del cache[next(iter(cache))]
+    
+    @single_flight
+    async def _query_entities(self, limit: int, entity_type: Optional[str]) -> Dict[str, Any]:
+        """Query entities and statistics from the recorder (or mock data without a database)"""
         if not db_pool:
             # Return mock entities
+            now = datetime.utcnow()
             mock_entities = [
-                {"entity_id": "sensor.temperature", "last_seen": datetime.utcnow().isoformat() + "Z"},
-                {"entity_id": "sensor.humidity", "last_seen": datetime.utcnow().isoformat() + "Z"},
-                {"entity_id": "sensor.pressure", "last_seen": datetime.utcnow().isoformat() + "Z"},
-                {"entity_id": "sensor.power_consumption", "last_seen": datetime.utcnow().isoformat() + "Z"},
-                {"entity_id": "binary_sensor.door", "last_seen": datetime.utcnow().isoformat() + "Z"}
+                {"entity_id": "sensor.temperature", "last_seen": now},
+                {"entity_id": "sensor.humidity", "last_seen": now},
+                {"entity_id": "sensor.pressure", "last_seen": now},
+                {"entity_id": "sensor.power_consumption", "last_seen": now},
+                {"entity_id": "binary_sensor.door", "last_seen": now}
             ]
             
             mock_statistics = [
@@ -512,82 +1005,38 @@ class HAMCPServer:
             }
         
         try:
-            async with db_pool.acquire() as conn:
-                # Build entity query with optional type filter
-                entity_where = ""
-                params = []
-                param_idx = 1
-                
-                if entity_type:
-                    entity_where = f"AND sm.entity_id LIKE ${param_idx}"
-                    params.append(f"{entity_type}.%")
-                    param_idx += 1
-                
-                # Add time constraint and limit
-                params.extend([
-                    (datetime.utcnow() - timedelta(days=7)).timestamp(),
-                    limit
-                ])
-                
-                query = f"""
-                    SELECT DISTINCT
-                        sm.entity_id,
-                        MAX(s.last_updated_ts) as last_seen_ts
-                    FROM states_meta sm
-                    LEFT JOIN states s ON s.metadata_id = sm.metadata_id
-                        AND s.last_updated_ts > ${param_idx-1}
-                    WHERE 1=1 {entity_where}
-                    GROUP BY sm.entity_id
-                    HAVING MAX(s.last_updated_ts) IS NOT NULL
-                    ORDER BY MAX(s.last_updated_ts) DESC
-                    LIMIT ${param_idx}
-                """
-                
-                rows = await conn.fetch(query, *params)
-                
-                entities = [{
-                    "entity_id": row['entity_id'],
-                    "last_seen": datetime.fromtimestamp(row['last_seen_ts']).isoformat() + "Z"
-                } for row in rows]
-                
-                # Get available statistics
-                stats_params = [limit]
-                stats_where = ""
-                if entity_type:
-                    stats_where = f"WHERE statistic_id LIKE ${len(stats_params)+1}"
-                    stats_params.append(f"{entity_type}.%")
-                
-                stats_query = f"""
-                    SELECT 
-                        statistic_id,
-                        source,
-                        unit_of_measurement
-                    FROM statistics_meta
-                    {stats_where}
-                    ORDER BY statistic_id
-                    LIMIT $1
-                """
-                
-                stats_rows = await conn.fetch(stats_query, *stats_params)
-                
-                statistics = [{
-                    "statistic_id": row['statistic_id'],
-                    "source": row['source'],
-                    "unit": row['unit_of_measurement']
-                } for row in stats_rows]
-                
-                return {
-                    "entities": entities,
-                    "statistics": statistics,
-                    "entity_count": len(entities),
-                    "statistic_count": len(statistics),
-                    "query_time": datetime.utcnow().isoformat() + "Z",
-                    "filter": {
-                        "entity_type": entity_type,
-                        "limit": limit
-                    }
+            since_ts = (datetime.utcnow() - timedelta(days=7)).timestamp()
+            pattern = (f"{entity_type}.%",) if entity_type else ()
+            
+            # Independent queries: run them on separate pool connections concurrently
+            rows, stats_rows = await asyncio.gather(
+                db_pool.fetch(ENTITIES_SQL[bool(entity_type)], since_ts, limit, *pattern),
+                db_pool.fetch(STATISTICS_LIST_SQL[bool(entity_type)], limit, *pattern)
+            )
+            
+            entities = [{
+                "entity_id": row['entity_id'],
+                "last_seen": datetime.fromtimestamp(row['last_seen_ts'], timezone.utc)
+            } for row in rows]
+            
+            statistics = [{
+                "statistic_id": row['statistic_id'],
+                "source": row['source'],
+                "unit": row['unit_of_measurement']
+            } for row in stats_rows]
+            
+            return {
+                "entities": entities,
+                "statistics": statistics,
+                "entity_count": len(entities),
+                "statistic_count": len(statistics),
+                "query_time": datetime.utcnow(),
+                "filter": {
+                    "entity_type": entity_type,
+                    "limit": limit
                 }
-                
+            }
+            
         except Exception as e:
             logger.error(f"💥 Database error in list_entities: {e}")
             return {
@@ -597,95 +1046,63 @@ class HAMCPServer:
             }
     
     async def health_check(self) -> Dict[str, Any]:
-        """Check server and database health"""
-        db_status = "disconnected"
-        db_info = None
-        
+        """Check server and database health from the last background probe"""
+        database = dict(db_health)
         if db_pool:
-            try:
-                async with db_pool.acquire() as conn:
-                    await conn.fetchval("SELECT 1")
-                    db_status = "healthy"
-                    
-                    # Get database info
-                    version = await conn.fetchval("SELECT version()")
-                    db_info = {
-                        "version": version,
-                        "host": DB_HOST,
-                        "database": DB_NAME,
-                        "read_only": READ_ONLY
-                    }
-                    
-                    # Check TimescaleDB
-                    if ENABLE_TIMESCALE:
-                        try:
-                            result = await conn.fetchval(
-                                "SELECT COUNT(*) FROM pg_extension WHERE extname = 'timescaledb'"
-                            )
-                            db_info["timescaledb"] = result > 0
-                        except:
-                            db_info["timescaledb"] = False
-                    
-            except Exception as e:
-                db_status = "unhealthy"
-                db_info = {"error": str(e)}
+            database["pool"] = {
+                "size": db_pool.get_size(),
+                "idle": db_pool.get_idle_size()
+            }
         
         return {
             "status": "ok",
             "version": "6.4",
-            "timestamp": datetime.utcnow().isoformat() + "Z",
-            "database": {
-                "status": db_status,
-                "info": db_info
-            },
+            "timestamp": datetime.utcnow(),
+            "database": database,
             "configuration": {
                 "read_only": READ_ONLY,
                 "timescaledb": ENABLE_TIMESCALE,
                 "query_timeout": QUERY_TIMEOUT,
-                "max_query_days": MAX_QUERY_DAYS
+                "max_query_days": MAX_QUERY_DAYS,
+                "pgbouncer": PGBOUNCER,
+                "state_notifications": notify_conn is not None
             },
             "transport": "SSE",
             "connected_clients": len(connected_clients)
         }
     
-    def generate_mock_series(self, start: str, end: str, interval: str = "1h") -> List[Dict]:
+    def generate_mock_series(
+        self,
+        start: Union[str, datetime],
+        end: Union[str, datetime],
+        interval: str = "1h"
+    ) -> List[Dict]:
         """Generate mock time series data for testing"""
         try:
-            start_dt = datetime.fromisoformat(start.replace("Z", "+00:00"))
-            end_dt = datetime.fromisoformat(end.replace("Z", "+00:00"))
+            start_dt = _parse_iso(start)
+            end_dt = _parse_iso(end)
         except:
             # Fallback to current time
             end_dt = datetime.utcnow()
             start_dt = end_dt - timedelta(hours=24)
         
-        # Determine interval in hours
-        interval_hours = {
-            "5m": 1/12, "15m": 0.25, "30m": 0.5,
-            "1h": 1, "6h": 6, "1d": 24
-        }.get(interval, 1)
+        step = timedelta(hours=MOCK_INTERVAL_HOURS.get(interval, 1))
+        count = min(MOCK_MAX_POINTS, max(0, math.ceil((end_dt - start_dt) / step)))
         
-        series = []
-        current = start_dt
-        value = 20.0
-        
-        while current < end_dt and len(series) < 1000:  # Limit series length
-            series.append({
-                "t": current.isoformat() + "Z",
-                "v": round(value + (hash(str(current)) % 10) - 5, 2)
-            })
-            current += timedelta(hours=interval_hours)
-            value += 0.1
-        
-        return series
+        # Fresh dicts on every call: callers round and reformat them in place
+        return [{"t": start_dt + i * step, "v": MOCK_VALUES[i]} for i in range(count)]
 
 # =============================================================================
 # Database Connection Management
 # =============================================================================
 
 async def init_database_connection() -> bool:
-    """Initialize database connection pool"""
+    """Initialize database connection pool; a pool that is already open is reused"""
     global db_pool
     
+    if db_pool is not None:
+        return True
+    
     try:
         logger.info("🔍 Testing database connection...")
         
@@ -705,10 +1122,16 @@ async def init_database_connection() -> bool:
         if DB_PASSWORD:
             conn_params["password"] = DB_PASSWORD
         
+        # PgBouncer in transaction pooling mode hands each transaction to any
+        # backend, so server-side prepared statements cannot be cached
+        if PGBOUNCER:
+            conn_params["statement_cache_size"] = 0
+        
         # Create connection pool
         db_pool = await asyncpg.create_pool(
             min_size=2,
             max_size=10,
+            max_inactive_connection_lifetime=300,  # Let idle connections go between bursts
             **conn_params
         )
         
@@ -762,16 +1185,53 @@ async def close_database_connection():
     global db_pool
     if db_pool:
         await db_pool.close()
+        db_pool = None
         logger.info("🔌 Database connection closed")
 
+async def probe_database():
+    """Run one database health probe and record the result in db_health"""
+    global db_health
+    if not db_pool:
+        db_health = {"status": "disconnected", "info": None}
+        return
+    
+    try:
+        # One round trip on whichever pool connection is free
+        version, timescaledb = await db_pool.fetchrow(HEALTH_PROBE_SQL)
+        db_info = {
+            "version": version,
+            "host": DB_HOST,
+            "database": DB_NAME,
+            "read_only": READ_ONLY
+        }
+        if ENABLE_TIMESCALE:
+            db_info["timescaledb"] = timescaledb
+        
+        db_health = {"status": "healthy", "info": db_info, "checked_at": datetime.utcnow()}
+    except Exception as e:
+        if db_health["status"] != "unhealthy":
+            logger.warning(f"⚠️ Database health probe failed: {e}")
+        db_health = {"status": "unhealthy", "info": {"error": str(e)}, "checked_at": datetime.utcnow()}
+
+async def db_health_monitor():
+    """Refresh db_health every DB_HEALTH_INTERVAL seconds so /health never waits on the database"""
+    while True:
+        await asyncio.sleep(DB_HEALTH_INTERVAL)
+        await probe_database()
+        
+        # Notifications would stop silently if the LISTEN connection died (e.g. a database restart)
+        if STATE_NOTIFY and not PGBOUNCER and db_health["status"] == "healthy":
+            try:
+                await ensure_state_listener()
+            except Exception as e:
+                logger.warning(f"⚠️ Could not listen for state changes: {e}")
+
 # =============================================================================
 # FastAPI Routes - SSE Transport + Web UI
 # =============================================================================
 
-@app.get("/", response_class=HTMLResponse)
-async def root():
-    """Root endpoint with information about the MCP server"""
-    return """
+# The info page is static (status is fetched client-side), so encode it once
+ROOT_HTML = """
     <!DOCTYPE html>
     <html>
     <head>
@@ -814,6 +1274,10 @@ async def root():
             <p><strong>General MCP:</strong> <span class="endpoint">GET /mcp</span></p>
             <p><strong>Tool Calls:</strong> <span class="endpoint">POST /mcp/call</span></p>
             <p><strong>Health Check:</strong> <span class="endpoint">GET /health</span></p>
+            <p><strong>Client Bootstrap:</strong> <span class="endpoint">GET /bootstrap</span></p>
+            <p><strong>History (JSON / MessagePack):</strong>
+                <span class="endpoint">GET /history?entity_id=...&amp;start=...&amp;end=...&amp;format=msgpack</span>
+            </p>
             <p><strong>Test SSE:</strong> <a href="/sse" target="_blank">Open HA SSE Stream</a> | <a href="/mcp" target="_blank">Open Generic SSE</a></p>
         </div>
 
@@ -876,30 +1340,194 @@ async def root():
         </script>
     </body>
     </html>
-    """
+    """.encode()
+
+@app.get("/", response_class=HTMLResponse)
+async def root():
+    """Root endpoint with information about the MCP server"""
+    return HTMLResponse(ROOT_HTML)
 
 @app.get("/health")
 async def health_endpoint():
     """Health check endpoint"""
     if mcp_server_instance:
-        return await mcp_server_instance.health_check()
-    return {"status": "error", "message": "MCP server not initialized"}
+        return OrjsonResponse(await mcp_server_instance.health_check())
+    return OrjsonResponse({"status": "error", "message": "MCP server not initialized"})
+
+@app.get("/bootstrap")
+async def bootstrap_endpoint(limit: int = 100, entity_type: Optional[str] = None):
+    """Health, entities and statistics in one round-trip for client start-up"""
+    if not mcp_server_instance:
+        return OrjsonResponse({"status": "error", "message": "MCP server not initialized"})
+    
+    health, catalog = await asyncio.gather(
+        mcp_server_instance.health_check(),
+        mcp_server_instance.list_entities(limit=limit, entity_type=entity_type)
+    )
+    return OrjsonResponse({"health": health, **catalog})
+
+@app.get("/history")
+async def history_endpoint(
+    request: Request,
+    entity_id: str,
+    start: str,
+    end: str,
+    interval: str = "1h",
+    aggregation: str = "mean",
+    limit: int = MAX_RAW_ROWS,
+    numeric: bool = True,
+    precision: Optional[int] = None,
+    time_format: str = "iso",
+    format: Optional[str] = None
+):
+    """History as JSON or, for format=msgpack / Accept: application/msgpack, columnar MessagePack"""
+    if not mcp_server_instance:
+        return OrjsonResponse({"status": "error", "message": "MCP server not initialized"})
+    
+    try:
+        start_dt, end_dt = _parse_iso(start), _parse_iso(end)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid date format: {e}")
+    
+    if format is None:
+        format = "msgpack" if "application/msgpack" in request.headers.get("accept", "") else "json"
+    
+    if format == "json" and interval == "raw" and numeric and precision is None and time_format == "iso":
+        payload = await mcp_server_instance.get_history_json(entity_id, start_dt, end_dt, limit, aggregation)
+        if payload is not None:
+            return Response(content=payload, media_type="application/json")
+    
+    result = await mcp_server_instance.get_history(
+        entity_id, start_dt, end_dt, interval=interval, aggregation=aggregation,
+        limit=limit, numeric=numeric, precision=precision, time_format=time_format
+    )
+    
+    if format != "msgpack" or "error" in result:
+        return OrjsonResponse(result)
+    
+    # Columnar layout: epoch seconds and values as two flat arrays. The result
+    # may be shared with concurrent identical requests, so reshape a copy
+    result = dict(result)
+    series = result.pop("series")
+    result.pop("query_time", None)
+    if "time_range" in result:
+        result["time_range"] = {key: value.timestamp() for key, value in result["time_range"].items()}
+    result["t"] = [
+        point["t"].timestamp() if isinstance(point["t"], datetime) else point["t"]
+        for point in series
+    ]
+    result["v"] = [point["v"] for point in series]
+    return Response(content=msgpack.packb(result, use_bin_type=True), media_type="application/msgpack")
+
+async def resolve_history_request(entity_id: str, start: str, end: str):
+    """Validate a streaming history request up front; returns (metadata_id, start_dt, end_dt)"""
+    if not db_pool:
+        raise HTTPException(status_code=503, detail="Database not available")
+    
+    try:
+        start_dt, end_dt = _parse_iso(start), _parse_iso(end)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid date format: {e}")
+    if (end_dt - start_dt).days > MAX_QUERY_DAYS:
+        raise HTTPException(status_code=400, detail=f"Query range exceeds {MAX_QUERY_DAYS} days")
+    
+    entity_meta = await db_pool.fetchrow(ENTITY_META_SQL, entity_id)
+    if not entity_meta:
+        raise HTTPException(status_code=404, detail=f"Entity '{entity_id}' not found in database")
+    
+    return entity_meta['metadata_id'], start_dt, end_dt
+
+@app.get("/history/stream")
+async def history_stream_endpoint(entity_id: str, start: str, end: str, numeric: bool = True, format: str = "json"):
+    """Raw history of any length streamed from a server-side cursor, as a JSON array or NDJSON"""
+    metadata_id, start_dt, end_dt = await resolve_history_request(entity_id, start, end)
+    
+    ndjson = format == "ndjson"
+    
+    def encode(batch: List[Dict[str, Any]], separator: bytes) -> bytes:
+        if ndjson:
+            return b"".join(orjson.dumps(point, option=ORJSON_OPTIONS) + b"\n" for point in batch)
+        return separator + orjson.dumps(batch, option=ORJSON_OPTIONS)[1:-1]
+    
+    async def generate_rows():
+        query = HISTORY_RAW_SQL if numeric else HISTORY_RAW_STATE_SQL
+        separator = b""
+        if not ndjson:
+            yield b"["
+        async with db_pool.acquire() as conn, conn.transaction():
+            # LIMIT NULL: the cursor bounds memory instead of MAX_RAW_ROWS
+            cursor = conn.cursor(query, metadata_id,
+                                 start_dt.timestamp(), end_dt.timestamp(), None,
+                                 prefetch=STREAM_FETCH_SIZE)
+            batch = []
+            async for timestamp, value in cursor:
+                if not numeric and _is_numeric(value):
+                    value = float(value)
+                batch.append({"t": timestamp, "v": value})
+                if len(batch) == STREAM_FETCH_SIZE:
+                    yield encode(batch, separator)
+                    separator, batch = b",", []
+            if batch:
+                yield encode(batch, separator)
+        if not ndjson:
+            yield b"]"
+    
+    return StreamingResponse(generate_rows(), media_type="application/x-ndjson" if ndjson else "application/json")
+
+@app.get("/history/export")
+async def history_export_endpoint(entity_id: str, start: str, end: str):
+    """All recorded states of an entity as CSV, sent straight from COPY ... TO STDOUT"""
+    metadata_id, start_dt, end_dt = await resolve_history_request(entity_id, start, end)
+    
+    chunks: asyncio.Queue = asyncio.Queue(maxsize=16)
+    
+    async def copy_rows():
+        try:
+            async with db_pool.acquire() as conn:
+                await conn.copy_from_query(HISTORY_EXPORT_SQL, metadata_id,
+                                           start_dt.timestamp(), end_dt.timestamp(),
+                                           output=chunks.put, format="csv", header=True)
+        except Exception:
+            await chunks.put(None)  # Wake the reader; it raises the error from copy_task
+            raise
+        # No end marker after a cancel: the reader has stopped, and putting it
+        # on a full queue would block this task forever
+        await chunks.put(None)
+    
+    async def generate_csv():
+        copy_task = asyncio.create_task(copy_rows())
+        try:
+            while (chunk := await chunks.get()) is not None:
+                yield bytes(chunk)
+            await copy_task  # Surface COPY errors instead of ending the file quietly
+        finally:
+            copy_task.cancel()
+    
+    return StreamingResponse(
+        generate_csv(),
+        media_type="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{entity_id}.csv"'}
+    )
 
 @app.get("/mcp-test")
 async def mcp_test_endpoint():
     """Simple test endpoint for MCP Client connectivity"""
-    return {
+    return OrjsonResponse({
         "status": "ok",
         "server": "ha-mcp-server",
         "version": "6.4",
         "endpoints": {
             "sse": "/sse",
             "mcp": "/mcp",
-            "health": "/health"
+            "health": "/health",
+            "bootstrap": "/bootstrap",
+            "history": "/history",
+            "history_stream": "/history/stream",
+            "history_export": "/history/export"
         },
-        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "timestamp": datetime.utcnow(),
         "message": "MCP Server is ready for connections"
-    }
+    })
 
 @app.options("/sse")
 async def sse_options():
@@ -931,31 +1559,17 @@ async def mcp_test_options():
 async def sse_endpoint(request: Request):
     """SSE endpoint specifically for Home Assistant MCP Client"""
     client_id = str(uuid.uuid4())
-    connected_clients.add(client_id)
+    queue = connected_clients[client_id] = asyncio.Queue(maxsize=8)
     
     logger.info(f"🔗 HA MCP Client connected via /sse: {client_id}")
-    logger.info(f"🌍 Client headers: {dict(request.headers)}")
-    logger.info(f"🔍 Client info: {request.client.host if request.client else 'unknown'}:{request.client.port if request.client else 'unknown'}")
-    logger.info(f"🌐 Request URL: {request.url}")
+    logger.debug("🌍 Client headers: %s", request.headers)
+    logger.debug("🔍 Client info: %s", request.client)
+    logger.debug("🌐 Request URL: %s", request.url)
     
     async def generate_mcp_events():
         try:
             # Send initialization event
-            init_event = {
-                "jsonrpc": "2.0",
-                "method": "notifications/initialized",
-                "params": {
-                    "protocolVersion": "2024-11-05",
-                    "capabilities": {
-                        "tools": {}
-                    },
-                    "serverInfo": {
-                        "name": "ha-mcp-server",
-                        "version": "6.4"
-                    }
-                }
-            }
-            yield f"data: {json.dumps(init_event)}\n\n"
+            yield INIT_FRAME
             logger.info("🔄 Sent initialization event to HA MCP Client")
             
             # Small delay to ensure proper initialization
@@ -963,52 +1577,30 @@ async def sse_endpoint(request: Request):
             
             # Send tools list
             if mcp_server_instance:
-                tools_event = {
-                    "jsonrpc": "2.0", 
-                    "method": "tools/list",
-                    "result": {
-                        "tools": [
-                            {
-                                "name": tool.name,
-                                "description": tool.description,
-                                "inputSchema": tool.inputSchema
-                            }
-                            for tool in mcp_server_instance.tools
-                        ]
-                    }
-                }
-                yield f"data: {json.dumps(tools_event)}\n\n"
+                yield mcp_server_instance.tools_frame
                 logger.info(f"🛠️ Sent {len(mcp_server_instance.tools)} tools to HA MCP Client")
                 
                 # Small delay after sending tools
                 await asyncio.sleep(0.1)
             
-            # Keep connection alive with pings
-            sequence = 0
+            # Relay frames (keep-alive pings) fanned out by sse_heartbeat()
             while True:
-                await asyncio.sleep(30)  # Ping every 30 seconds
+                frame = await queue.get()
                 
                 # Check if client disconnected
                 if await request.is_disconnected():
                     logger.info(f"🔌 HA MCP Client disconnected: {client_id}")
                     break
-                    
-                sequence += 1
-                ping_event = {
-                    "jsonrpc": "2.0",
-                    "method": "ping", 
-                    "params": {
-                        "sequence": sequence,
-                        "timestamp": datetime.utcnow().isoformat() + "Z"
-                    }
-                }
-                yield f"data: {json.dumps(ping_event)}\n\n"
-                logger.debug(f"🏓 Ping {sequence} sent to HA MCP Client {client_id}")
                 
+                yield frame
+                
+        except asyncio.CancelledError:
+            logger.info(f"🔌 HA MCP Client disconnected: {client_id}")
+            raise
         except Exception as e:
             logger.error(f"SSE error for HA MCP Client {client_id}: {e}")
         finally:
-            connected_clients.discard(client_id)
+            connected_clients.pop(client_id, None)
             logger.info(f"🔌 HA MCP Client removed: {client_id}")
     
     return StreamingResponse(
@@ -1029,33 +1621,133 @@ async def sse_endpoint(request: Request):
         }
     )
 
+async def sse_heartbeat():
+    """Send one keep-alive ping frame to every connected SSE client"""
+    sequence = 0
+    while True:
+        await asyncio.sleep(SSE_PING_INTERVAL)
+        if not connected_clients:
+            continue
+        
+        sequence += 1
+        ping_event = {
+            "jsonrpc": "2.0",
+            "method": "ping", 
+            "params": {
+                "sequence": sequence,
+                "timestamp": datetime.utcnow()
+            }
+        }
+        broadcast_frame(sse_frame(ping_event))
+        logger.debug(f"🏓 Ping {sequence} sent to {len(connected_clients)} HA MCP Client(s)")
+
+def broadcast_frame(frame: bytes) -> None:
+    """Queue one encoded frame for every connected SSE client"""
+    for queue in list(connected_clients.values()):
+        try:
+            queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            pass  # Client is not reading; drop rather than block everyone else
+
+def on_state_notify(conn, pid: int, channel: str, payload: str) -> None:
+    """Forward a recorder state change notification to the SSE clients"""
+    if not connected_clients:
+        return
+    try:
+        params = orjson.loads(payload)
+    except orjson.JSONDecodeError:
+        logger.debug(f"Ignoring non-JSON notification on {channel}: {payload[:100]}")
+        return
+    broadcast_frame(sse_frame({
+        "jsonrpc": "2.0",
+        "method": "notifications/state_changed",
+        "params": params
+    }))
+
+async def start_state_listener() -> None:
+    """Hold one pool connection that LISTENs for recorder state changes"""
+    global notify_conn
+    if PGBOUNCER:
+        logger.warning("⚠️ State notifications need a session connection - disabled in PgBouncer mode")
+        return
+    
+    conn = await db_pool.acquire()
+    try:
+        await conn.add_listener(STATE_NOTIFY_CHANNEL, on_state_notify)
+    except Exception:
+        await db_pool.release(conn)
+        raise
+    notify_conn = conn
+    logger.info(f"📣 Listening for state changes on '{STATE_NOTIFY_CHANNEL}'")
+
+async def stop_state_listener() -> None:
+    """Release the LISTEN connection back to the pool; never raises, so shutdown always goes on"""
+    global notify_conn
+    conn, notify_conn = notify_conn, None
+    if conn is None:
+        return
+    
+    try:
+        await conn.remove_listener(STATE_NOTIFY_CHANNEL, on_state_notify)
+    except Exception as e:
+        logger.debug(f"Could not UNLISTEN on '{STATE_NOTIFY_CHANNEL}': {e}")
+    try:
+        if db_pool:
+            await db_pool.release(conn)
+    except Exception as e:
+        logger.debug(f"Could not release the notification connection: {e}")
+
+async def ensure_state_listener() -> None:
+    """LISTEN again on a fresh pool connection if the notification connection has died"""
+    if notify_conn is not None:
+        try:
+            if not notify_conn.is_closed():
+                return
+        except asyncpg.InterfaceError:
+            pass  # The pool has already taken the dead connection back
+        logger.warning("⚠️ State notification connection lost - listening again")
+        await stop_state_listener()
+    await start_state_listener()
+
 # Add a simple test endpoint that simulates tool calls
+class ToolCall(BaseModel):
+    """Body of a /test-tool call, validated once by FastAPI"""
+    model_config = ConfigDict(extra="ignore")
+    
+    tool: str = "health_check"
+    arguments: Dict[str, Any] = {}
+
+TOOL_NAMES = frozenset(tool.name for tool in MCP_TOOLS)
+
+async def run_test_tool(call: ToolCall) -> Dict[str, Any]:
+    """Run one /test-tool call; unknown tools come back as an error result"""
+    if call.tool not in TOOL_NAMES:
+        return {"error": f"Unknown tool: {call.tool}"}
+    return await mcp_server_instance.dispatch_tool(call.tool, call.arguments)
+
 @app.post("/test-tool")
-async def test_tool_call(request_data: dict):
-    """Test endpoint to simulate MCP tool calls"""
+async def test_tool_call(request_data: Union[ToolCall, List[ToolCall]] = Body(...)):
+    """Test endpoint to simulate MCP tool calls; a list of calls runs concurrently"""
     try:
-        tool_name = request_data.get("tool", "health_check")
-        arguments = request_data.get("arguments", {})
-        
         if mcp_server_instance:
-            if tool_name == "get_history":
-                result = await mcp_server_instance.get_history(**arguments)
-            elif tool_name == "get_statistics":
-                result = await mcp_server_instance.get_statistics(**arguments)
-            elif tool_name == "list_entities":
-                result = await mcp_server_instance.list_entities(**arguments)
-            elif tool_name == "health_check":
-                result = await mcp_server_instance.health_check()
-            else:
-                result = {"error": f"Unknown tool: {tool_name}"}
+            if isinstance(request_data, list):
+                results = await asyncio.gather(
+                    *(run_test_tool(call) for call in request_data),
+                    return_exceptions=True
+                )
+                return OrjsonResponse({"success": True, "results": [
+                    {"error": str(result)} if isinstance(result, Exception) else result
+                    for result in results
+                ]})
             
-            return {"success": True, "result": result}
+            result = await run_test_tool(request_data)
+            return OrjsonResponse({"success": True, "result": result})
         else:
-            return {"success": False, "error": "MCP server not initialized"}
+            return OrjsonResponse({"success": False, "error": "MCP server not initialized"})
     
     except Exception as e:
         logger.error(f"Test tool error: {e}")
-        return {"success": False, "error": str(e)}
+        return OrjsonResponse({"success": False, "error": str(e)})
 
 # =============================================================================
 # Main Entry Point
@@ -1063,7 +1755,7 @@ async def test_tool_call(request_data: dict):
 
 async def startup_event():
     """Initialize everything on startup"""
-    global mcp_server_instance
+    global mcp_server_instance, heartbeat_task, health_task
     
     logger.info("🚀 Starting Home Assistant MCP Server")
     logger.info("📦 Version: 6.4")
@@ -1077,15 +1769,34 @@ async def startup_event():
         logger.info("🎭 All queries will return mock data")
     else:
         logger.info("✅ Database connected - ready to serve real data")
+        
+        if STATE_NOTIFY:
+            try:
+                await start_state_listener()
+            except Exception as e:
+                logger.warning(f"⚠️ Could not listen for state changes: {e}")
     
     # Create MCP server instance
     mcp_server_instance = HAMCPServer()
     logger.info("🌐 MCP server initialized with SSE transport")
     logger.info(f"🔗 SSE endpoint: http://localhost:{MCP_PORT}/sse")
+    
+    # One timer keeps all SSE streams alive
+    heartbeat_task = asyncio.create_task(sse_heartbeat())
+    
+    # Probe once so the first /health is accurate, then keep the result fresh
+    await probe_database()
+    if db_pool:
+        health_task = asyncio.create_task(db_health_monitor())
 
 async def shutdown_event():
     """Cleanup on shutdown"""
     logger.info("🛑 Shutting down MCP Server...")
+    if heartbeat_task:
+        heartbeat_task.cancel()
+    if health_task:
+        health_task.cancel()
+    await stop_state_listener()
     await close_database_connection()
     logger.info("🛑 Server shutdown complete")
 
@@ -1108,13 +1819,20 @@ if __name__ == "__main__":
     logger.info(f"🐛 Known Issue: HA Core MCP integration has SSL blocking calls (not server issue)")
     logger.info(f"")
     
+    # uvloop/httptools ship in the add-on image; fall back for local runs without them
+    loop = "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+    http = "httptools" if importlib.util.find_spec("httptools") else "h11"
+    logger.info(f"⚙️ Event loop: {loop}, HTTP parser: {http}")
+    
     # Configure uvicorn to be HTTP-only
     uvicorn_config = uvicorn.Config(
         app=app,
         host="0.0.0.0",
         port=MCP_PORT,
         log_level="info" if os.getenv("LOG_LEVEL", "INFO").upper() != "DEBUG" else "debug",
-        access_log=True,
+        access_log=os.getenv("LOG_LEVEL", "INFO").upper() == "DEBUG",  # A log write per request otherwise
+        loop=loop,
+        http=http,
         server_header=False,  # Don't advertise server type
         date_header=False     # Reduce header overhead
     )
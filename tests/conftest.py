@@ -4,7 +4,9 @@ Pytest configuration and shared fixtures
 import pytest
 import sys
 import os
-from unittest.mock import MagicMock
+import importlib.util
+from types import ModuleType
+from unittest.mock import AsyncMock
 
 # Add parent directory to path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'mcp-server'))
@@ -12,6 +14,90 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'mcp-server'))
 # Configure pytest
 pytest_plugins = []
 
+MCP_STUB_MODULES = ('mcp', 'mcp.types', 'mcp.server', 'mcp.server.models',
+                    'mcp.server.stdio', 'mcp.server.fastmcp')
+
+class _Model:
+    """Keyword-argument record standing in for the mcp.types pydantic models"""
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+class MockServer:
+    """Mock of mcp.server.Server that keeps the registered handlers"""
+    def __init__(self, name):
+        self.name = name
+        self.handlers = {}
+    
+    def list_tools(self):
+        """Decorator for the tools/list handler"""
+        def decorator(func):
+            self.handlers['list_tools'] = func
+            return func
+        return decorator
+    
+    def call_tool(self):
+        """Decorator for the tools/call handler"""
+        def decorator(func):
+            self.handlers['call_tool'] = func
+            return func
+        return decorator
+
+class MockFastMCP:
+    def __init__(self, name):
+        self.name = name
+        self.tools = {}
+        
+    def tool(self):
+        """Decorator for registering tools"""
+        def decorator(func):
+            self.tools[func.__name__] = func
+            return func
+        return decorator
+    
+    async def run(self, read_stream, write_stream, options):
+        """Mock run method"""
+        pass
+    
+    def create_initialization_options(self):
+        """Mock initialization options"""
+        return {}
+
+class _NullStdio:
+    """async with stand-in for mcp.server.stdio.stdio_server()"""
+    async def __aenter__(self):
+        return AsyncMock(), AsyncMock()
+    
+    async def __aexit__(self, *exc):
+        return False
+
+def install_mcp_stubs():
+    """Register plain stub modules for the mcp package; cheaper than MagicMock and importable as packages"""
+    if getattr(sys.modules.get('mcp'), '__mcp_stub__', False):
+        return
+    
+    modules = {name: ModuleType(name) for name in MCP_STUB_MODULES}
+    modules['mcp'].__mcp_stub__ = True
+    modules['mcp'].__path__ = []
+    modules['mcp.server'].__path__ = []
+    
+    modules['mcp.types'].Tool = type('Tool', (_Model,), {})
+    modules['mcp.types'].TextContent = type('TextContent', (_Model,), {})
+    modules['mcp.server'].Server = MockServer
+    modules['mcp.server'].NotificationOptions = type('NotificationOptions', (_Model,), {})
+    modules['mcp.server.models'].InitializationOptions = type('InitializationOptions', (_Model,), {})
+    modules['mcp.server.stdio'].stdio_server = lambda: _NullStdio()
+    modules['mcp.server.fastmcp'].FastMCP = MockFastMCP
+    
+    # Parent packages expose their submodules as attributes, as after a real import
+    for name, module in modules.items():
+        parent, _, child = name.rpartition('.')
+        if parent:
+            setattr(modules[parent], child, module)
+    sys.modules.update(modules)
+
+# Installed at collection time so test modules can import server directly
+install_mcp_stubs()
+
 def pytest_configure(config):
     """Configure pytest"""
     config.addinivalue_line(
@@ -23,56 +109,37 @@ def pytest_configure(config):
     config.addinivalue_line(
         "markers", "unit: marks tests as unit tests"
     )
+    config.addinivalue_line(
+        "markers", "benchmark: pytest-benchmark microbenchmarks (run with 'make test-benchmark')"
+    )
 
 @pytest.fixture(scope="session", autouse=True)
 def mock_mcp_modules():
-    """Mock MCP modules for all tests"""
-    # Mock MCP modules before any imports
-    mock_mcp = MagicMock()
-    mock_fastmcp = MagicMock()
-    
-    # Create a mock FastMCP class
-    class MockFastMCP:
-        def __init__(self, name):
-            self.name = name
-            self.tools = {}
-            
-        def tool(self):
-            """Decorator for registering tools"""
-            def decorator(func):
-                self.tools[func.__name__] = func
-                return func
-            return decorator
-        
-        async def run(self, read_stream, write_stream, options):
-            """Mock run method"""
-            pass
-        
-        def create_initialization_options(self):
-            """Mock initialization options"""
-            return {}
-    
-    mock_fastmcp.FastMCP = MockFastMCP
-    
-    sys.modules['mcp'] = mock_mcp
-    sys.modules['mcp.server'] = mock_mcp
-    sys.modules['mcp.server.stdio'] = mock_mcp
-    sys.modules['mcp.server.fastmcp'] = mock_fastmcp
+    """Stub MCP modules for all tests"""
+    install_mcp_stubs()
     
     yield
     
     # Cleanup
-    for module in ['mcp', 'mcp.server', 'mcp.server.stdio', 'mcp.server.fastmcp']:
-        if module in sys.modules:
-            del sys.modules[module]
+    for module in MCP_STUB_MODULES:
+        sys.modules.pop(module, None)
 
-@pytest.fixture
+if sys.platform != "win32" and importlib.util.find_spec("uvloop"):
+    # Optional: only recent pytest-asyncio releases declare this hook; older
+    # ones ignore it and run the tests on the default loop
+    @pytest.hookimpl(optionalhook=True)
+    def pytest_asyncio_loop_factories(config, item):
+        """Run async tests on uvloop, as the add-on does, when it is installed"""
+        import uvloop
+        return {"uvloop": uvloop.new_event_loop}
+
+@pytest.fixture(autouse=True)
 def reset_server_state():
-    """Reset server state between tests"""
+    """Put the server globals back after each test so tests stay independent of order"""
     import server
-    server.db_pool = None
+    saved = server.db_pool, server.db_health, server.mcp_server_instance
     yield
-    server.db_pool = None
+    server.db_pool, server.db_health, server.mcp_server_instance = saved
 
 @pytest.fixture
 def mock_environment(monkeypatch):
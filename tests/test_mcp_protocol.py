@@ -3,45 +3,15 @@ Test MCP protocol communication
 """
 import pytest
 import asyncio
-import json
-from unittest.mock import Mock, AsyncMock, patch, MagicMock
+import orjson
+from unittest.mock import Mock, AsyncMock, patch
 import sys
 import os
 from io import StringIO
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'mcp-server'))
 
-# Mock MCP modules
-mock_mcp = MagicMock()
-mock_fastmcp = MagicMock()
-
-# Create a mock FastMCP class
-class MockFastMCP:
-    def __init__(self, name):
-        self.name = name
-        self.tools = {}
-        
-    def tool(self):
-        """Decorator for registering tools"""
-        def decorator(func):
-            self.tools[func.__name__] = func
-            return func
-        return decorator
-    
-    async def run(self, read_stream, write_stream, options):
-        """Mock run method"""
-        pass
-    
-    def create_initialization_options(self):
-        """Mock initialization options"""
-        return {}
-
-mock_fastmcp.FastMCP = MockFastMCP
-sys.modules['mcp'] = mock_mcp
-sys.modules['mcp.server'] = mock_mcp
-sys.modules['mcp.server.stdio'] = mock_mcp
-sys.modules['mcp.server.fastmcp'] = mock_fastmcp
-
+# The mcp package is stubbed by conftest.install_mcp_stubs()
 import server
 
 class TestMCPProtocol:
@@ -50,19 +20,25 @@ class TestMCPProtocol:
     @pytest.mark.asyncio
     async def test_tool_registration(self):
         """Test that all tools are registered with MCP"""
-        # Tools should be registered via decorator
-        assert hasattr(server.mcp, 'tools')
-        assert 'get_history' in server.mcp.tools
-        assert 'get_statistics' in server.mcp.tools
-        assert 'list_entities' in server.mcp.tools
-        assert 'health_check' in server.mcp.tools
+        mcp_server = server.HAMCPServer()
+        
+        # Handlers are registered via decorator
+        assert 'list_tools' in mcp_server.server.handlers
+        assert 'call_tool' in mcp_server.server.handlers
+        
+        tools = await mcp_server.server.handlers['list_tools']()
+        names = {tool.name for tool in tools}
+        assert 'get_history' in names
+        assert 'get_statistics' in names
+        assert 'list_entities' in names
+        assert 'health_check' in names
     
     @pytest.mark.asyncio
     async def test_tool_signatures(self):
         """Test tool function signatures"""
         # get_history should have correct parameters
         import inspect
-        sig = inspect.signature(server.get_history)
+        sig = inspect.signature(server.HAMCPServer.get_history)
         params = list(sig.parameters.keys())
         assert 'entity_id' in params
         assert 'start' in params
@@ -71,7 +47,7 @@ class TestMCPProtocol:
         assert 'aggregation' in params
         
         # get_statistics should have correct parameters
-        sig = inspect.signature(server.get_statistics)
+        sig = inspect.signature(server.HAMCPServer.get_statistics)
         params = list(sig.parameters.keys())
         assert 'statistic_id' in params
         assert 'start' in params
@@ -84,14 +60,14 @@ class TestMCPProtocol:
         server.db_pool = None
         
         # Simulate tool call
-        result = await server.get_history(
+        result = await server.HAMCPServer().get_history(
             entity_id="sensor.test",
             start="2024-12-19T00:00:00Z",
             end="2024-12-19T01:00:00Z"
         )
         
         # Result should be serializable to JSON
-        json_str = json.dumps(result)
+        json_str = server.dumps(result)
         assert json_str is not None
         
         # Result should have expected structure
@@ -104,16 +80,18 @@ class TestMCPProtocol:
         """Test error handling in MCP protocol"""
         server.db_pool = None
         
-        # Test with invalid date range
-        try:
-            await server.get_history(
-                entity_id="sensor.test",
-                start="2024-01-01T00:00:00Z",
-                end="2024-12-31T23:59:59Z"  # Exceeds max days
-            )
-            assert False, "Should have raised ValueError"
-        except ValueError as e:
-            assert "Query range exceeds" in str(e)
+        # Test with invalid date range; tools report errors in the result
+        result = await server.HAMCPServer().get_history(
+            entity_id="sensor.test",
+            start="2024-01-01T00:00:00Z",
+            end="2024-12-31T23:59:59Z"  # Exceeds max days
+        )
+        assert "Query range exceeds" in result["error"]
+        
+        # The call_tool handler wraps the result as JSON text content
+        handler = server.HAMCPServer().server.handlers['call_tool']
+        content = await handler("no_such_tool", {})
+        assert orjson.loads(content[0].text) == {"error": "Unknown tool: no_such_tool", "tool": "no_such_tool"}
 
 class TestMCPToolExecution:
     """Test MCP tool execution"""
@@ -139,21 +117,23 @@ class TestMCPToolExecution:
             ('health_check', {})
         ]
         
+        mcp_server = server.HAMCPServer()
         for tool_name, args in tools_to_test:
-            tool_func = server.mcp.tools.get(tool_name)
-            assert tool_func is not None, f"Tool {tool_name} not found"
+            assert tool_name in server.TOOL_NAMES, f"Tool {tool_name} not found"
             
-            result = await tool_func(**args)
+            result = await mcp_server.dispatch_tool(tool_name, args)
             assert result is not None
             assert isinstance(result, dict)
+            assert "error" not in result
     
     @pytest.mark.asyncio
     async def test_tool_execution_with_mock_data(self):
         """Test tools return mock data when no database"""
         server.db_pool = None
+        mcp_server = server.HAMCPServer()
         
         # Test get_history returns mock data
-        result = await server.get_history(
+        result = await mcp_server.get_history(
             entity_id="sensor.test",
             start="2024-12-19T00:00:00Z",
             end="2024-12-19T06:00:00Z",
@@ -163,7 +143,7 @@ class TestMCPToolExecution:
         assert len(result['series']) == 6
         
         # Test get_statistics returns mock data
-        result = await server.get_statistics(
+        result = await mcp_server.get_statistics(
             statistic_id="sensor.test",
             start="2024-12-19T00:00:00Z",
             end="2024-12-19T06:00:00Z"
@@ -171,7 +151,7 @@ class TestMCPToolExecution:
         assert result.get('mock_data') is True
         
         # Test list_entities returns mock data
-        result = await server.list_entities()
+        result = await mcp_server.list_entities()
         assert result.get('mock_data') is True
 
 class TestMCPServerLifecycle:
@@ -180,42 +160,40 @@ class TestMCPServerLifecycle:
     @pytest.mark.asyncio
     async def test_server_initialization(self):
         """Test server initialization"""
-        # Server should have MCP instance
-        assert hasattr(server, 'mcp')
-        assert server.mcp.name == "Home Assistant MCP Server"
+        # Server should wrap an MCP server instance with the tool list
+        mcp_server = server.HAMCPServer()
+        assert mcp_server.server.name == "ha-mcp-server"
+        assert mcp_server.tools is server.MCP_TOOLS
     
     @pytest.mark.asyncio
     async def test_database_initialization_on_startup(self):
         """Test database initialization during startup"""
-        with patch('server.init_db_pool') as mock_init:
-            mock_init.return_value = True
-            
-            # Mock the stdio server context
-            mock_read = AsyncMock()
-            mock_write = AsyncMock()
+        server.db_pool = None
+        
+        with patch('server.init_database_connection', new_callable=AsyncMock) as mock_init:
+            mock_init.return_value = False  # Mock mode
             
-            with patch('mcp.server.stdio.stdio_server') as mock_stdio:
-                mock_stdio.return_value.__aenter__ = AsyncMock(
-                    return_value=(mock_read, mock_write)
-                )
-                mock_stdio.return_value.__aexit__ = AsyncMock()
-                
-                with patch.object(server.mcp, 'run', new_callable=AsyncMock):
-                    try:
-                        await asyncio.wait_for(server.main(), timeout=0.1)
-                    except asyncio.TimeoutError:
-                        pass  # Expected, as server.main() runs forever
-                    
-                    mock_init.assert_called_once()
+            await server.startup_event()
+            try:
+                mock_init.assert_awaited_once()
+                assert isinstance(server.mcp_server_instance, server.HAMCPServer)
+                assert server.db_health["status"] == "disconnected"
+            finally:
+                await server.shutdown_event()
+        
+        # Shutdown stops the keep-alive timer
+        with pytest.raises(asyncio.CancelledError):
+            await server.heartbeat_task
     
     @pytest.mark.asyncio
     async def test_server_cleanup_on_shutdown(self):
         """Test cleanup on server shutdown"""
-        server.db_pool = AsyncMock()
+        pool = server.db_pool = AsyncMock()
         
-        await server.close_db_pool()
+        await server.close_database_connection()
         
-        server.db_pool.close.assert_called_once()
+        pool.close.assert_awaited_once()
+        assert server.db_pool is None
 
 class TestMCPMessageSerialization:
     """Test message serialization for MCP protocol"""
@@ -233,11 +211,11 @@ class TestMCPMessageSerialization:
         }
         
         # Should serialize to JSON without errors
-        json_str = json.dumps(response)
+        json_str = server.dumps(response)
         assert json_str is not None
         
         # Should deserialize back correctly
-        deserialized = json.loads(json_str)
+        deserialized = orjson.loads(json_str)
         assert deserialized == response
     
     def test_serialize_error_response(self):
@@ -248,10 +226,10 @@ class TestMCPMessageSerialization:
             "series": []
         }
         
-        json_str = json.dumps(error_response)
+        json_str = server.dumps(error_response)
         assert json_str is not None
         
-        deserialized = json.loads(json_str)
+        deserialized = orjson.loads(json_str)
         assert deserialized["error"] == "Entity not found"
     
     def test_serialize_complex_response(self):
@@ -270,10 +248,10 @@ class TestMCPMessageSerialization:
             }
         }
         
-        json_str = json.dumps(complex_response)
+        json_str = server.dumps(complex_response)
         assert json_str is not None
         
-        deserialized = json.loads(json_str)
+        deserialized = orjson.loads(json_str)
         assert len(deserialized["entities"]) == 2
         assert deserialized["metadata"]["version"] == "0.5.0"
 
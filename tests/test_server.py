@@ -4,37 +4,60 @@ Tests work without database or Home Assistant
 """
 import pytest
 import asyncio
+import asyncpg
+import importlib.util
 import json
-from datetime import datetime, timedelta
-from unittest.mock import Mock, AsyncMock, patch, MagicMock
+import msgpack
+import orjson
+from datetime import datetime, timezone
+from unittest.mock import ANY, Mock, MagicMock, AsyncMock, patch
+from fastapi import Request
 import sys
 import os
 
 # Add parent directory to path for imports
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'mcp-server'))
 
-# Mock the MCP imports before importing server
-sys.modules['mcp'] = MagicMock()
-sys.modules['mcp.server'] = MagicMock()
-sys.modules['mcp.server.stdio'] = MagicMock()
-sys.modules['mcp.server.fastmcp'] = MagicMock()
+# Now import our server module (the mcp package is stubbed by conftest)
+import server
 
-from mcp.server.fastmcp import FastMCP
+# Fixed time base so fixture data is identical on every run
+NOW = datetime(2024, 12, 19, 12, tzinfo=timezone.utc)
 
-# Now import our server module
-import server
+# Sample rows built once at import; tuples so no test can change them for the next.
+# Hourly over the twelve hours before NOW, oldest first as the history query orders them
+SAMPLE_HISTORY = tuple(
+    {
+        "timestamp": NOW.timestamp() - (12 - i) * 3600.0,
+        "state": 20.0 + i * 0.5
+    }
+    for i in range(12)
+)
+
+# SAMPLE_HISTORY as the (timestamp, value) records the history query returns
+HISTORY_ROWS = tuple(
+    (datetime.fromtimestamp(item["timestamp"], timezone.utc), item["state"])
+    for item in SAMPLE_HISTORY
+)
+
+# Metadata row returned by the entity lookup
+ENTITY_META = {"metadata_id": 123, "entity_id": "sensor.temperature"}
+
+SAMPLE_STATISTICS = tuple(
+    {
+        "timestamp": NOW.timestamp() - i * 3600.0,
+        "mean": 22.0 + i * 0.1,
+        "min": 20.0 + i * 0.1,
+        "max": 24.0 + i * 0.1,
+        "sum": 528.0
+    }
+    for i in range(24)
+)
 
 # =============================================================================
 # Fixtures
 # =============================================================================
 
-@pytest.fixture
-def mock_db_pool():
-    """Mock database pool"""
-    pool = AsyncMock()
-    pool.acquire = AsyncMock()
-    return pool
-
 @pytest.fixture
 def mock_connection():
     """Mock database connection"""
@@ -46,40 +69,33 @@ def mock_connection():
     return conn
 
 @pytest.fixture
+def mock_db_pool(mock_connection):
+    """Mock database pool whose acquire() context yields mock_connection"""
+    # acquire() is a plain call returning an async context manager; the spec
+    # makes the coroutine methods (fetch, close, ...) AsyncMocks
+    pool = MagicMock(spec=asyncpg.Pool)
+    pool.acquire.return_value.__aenter__ = AsyncMock(return_value=mock_connection)
+    pool.acquire.return_value.__aexit__ = AsyncMock(return_value=False)  # Let errors propagate
+    return pool
+
+@pytest.fixture(scope="module")
 def sample_entity_data():
     """Sample entity data for testing"""
     return {
         "entity_id": "sensor.temperature",
         "metadata_id": 123,
-        "last_seen": datetime.utcnow().timestamp()
+        "last_seen": NOW.timestamp()
     }
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def sample_history_data():
     """Sample history data for testing"""
-    base_time = datetime.utcnow()
-    return [
-        {
-            "timestamp": (base_time - timedelta(hours=i)).timestamp(),
-            "state": str(20.0 + i * 0.5)
-        }
-        for i in range(24)
-    ]
+    return SAMPLE_HISTORY
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def sample_statistics_data():
     """Sample statistics data for testing"""
-    base_time = datetime.utcnow()
-    return [
-        {
-            "timestamp": (base_time - timedelta(hours=i)).timestamp(),
-            "mean": 22.0 + i * 0.1,
-            "min": 20.0 + i * 0.1,
-            "max": 24.0 + i * 0.1,
-            "sum": 528.0
-        }
-        for i in range(24)
-    ]
+    return SAMPLE_STATISTICS
 
 # =============================================================================
 # Unit Tests
@@ -93,57 +109,54 @@ class TestHelperFunctions:
         start = "2024-12-19T00:00:00Z"
         end = "2024-12-19T06:00:00Z"
         
-        series = server.generate_mock_series(start, end, "1h")
+        series = server.HAMCPServer().generate_mock_series(start, end, "1h")
         
         assert len(series) == 6
         assert all("t" in item and "v" in item for item in series)
-        assert series[0]["t"].startswith("2024-12-19T00")
+        assert series[0]["t"] == datetime(2024, 12, 19, tzinfo=timezone.utc)
         assert isinstance(series[0]["v"], float)
     
-    def test_generate_mock_series_different_intervals(self):
+    @pytest.mark.parametrize("start,end,interval,expected", [
+        ("2024-12-19T00:00:00Z", "2024-12-19T01:00:00Z", "5m", 12),  # 60 minutes / 5 minutes
+        ("2024-12-19T00:00:00Z", "2024-12-19T01:00:00Z", "15m", 4),  # 60 minutes / 15 minutes
+        ("2024-12-01T00:00:00Z", "2024-12-08T00:00:00Z", "1d", 7),  # 7 days
+    ])
+    def test_generate_mock_series_different_intervals(self, start, end, interval, expected):
         """Test mock series with different intervals"""
-        start = "2024-12-19T00:00:00Z"
-        end = "2024-12-19T01:00:00Z"
-        
-        # Test 5-minute intervals
-        series_5m = server.generate_mock_series(start, end, "5m")
-        assert len(series_5m) == 12  # 60 minutes / 5 minutes
-        
-        # Test 15-minute intervals
-        series_15m = server.generate_mock_series(start, end, "15m")
-        assert len(series_15m) == 4  # 60 minutes / 15 minutes
-        
-        # Test daily intervals
-        start_day = "2024-12-01T00:00:00Z"
-        end_day = "2024-12-08T00:00:00Z"
-        series_1d = server.generate_mock_series(start_day, end_day, "1d")
-        assert len(series_1d) == 7  # 7 days
+        series = server.HAMCPServer().generate_mock_series(start, end, interval)
+        assert len(series) == expected
 
 class TestDatabaseConnection:
     """Test database connection management"""
     
     @pytest.mark.asyncio
-    async def test_init_db_pool_success(self, mock_connection):
+    async def test_init_db_pool_success(self, mock_db_pool, mock_connection):
         """Test successful database pool initialization"""
-        with patch('asyncpg.create_pool') as mock_create_pool:
-            mock_pool = AsyncMock()
-            mock_pool.acquire.return_value.__aenter__ = AsyncMock(return_value=mock_connection)
-            mock_pool.acquire.return_value.__aexit__ = AsyncMock()
-            mock_create_pool.return_value = mock_pool
+        server.db_pool = None
+        mock_connection.fetch = AsyncMock(return_value=[{"table_name": "states"}])
+        
+        with patch('asyncpg.create_pool', new_callable=AsyncMock) as mock_create_pool:
+            mock_create_pool.return_value = mock_db_pool
             
-            result = await server.init_db_pool()
+            result = await server.init_database_connection()
             
             assert result is True
-            assert server.db_pool is not None
-            mock_create_pool.assert_called_once()
+            assert server.db_pool is mock_db_pool
+            mock_create_pool.assert_awaited_once()
+            
+            # An open pool is reused
+            assert await server.init_database_connection() is True
+            mock_create_pool.assert_awaited_once()
     
     @pytest.mark.asyncio
     async def test_init_db_pool_failure(self):
         """Test database pool initialization failure"""
-        with patch('asyncpg.create_pool') as mock_create_pool:
+        server.db_pool = None
+        
+        with patch('asyncpg.create_pool', new_callable=AsyncMock) as mock_create_pool:
             mock_create_pool.side_effect = Exception("Connection failed")
             
-            result = await server.init_db_pool()
+            result = await server.init_database_connection()
             
             assert result is False
             assert server.db_pool is None
@@ -153,9 +166,10 @@ class TestDatabaseConnection:
         """Test closing database pool"""
         server.db_pool = mock_db_pool
         
-        await server.close_db_pool()
+        await server.close_database_connection()
         
-        mock_db_pool.close.assert_called_once()
+        mock_db_pool.close.assert_awaited_once()
+        assert server.db_pool is None
 
 class TestMCPTools:
     """Test MCP tool functions"""
@@ -165,7 +179,7 @@ class TestMCPTools:
         """Test get_history with no database (mock mode)"""
         server.db_pool = None
         
-        result = await server.get_history(
+        result = await server.HAMCPServer().get_history(
             entity_id="sensor.test",
             start="2024-12-19T00:00:00Z",
             end="2024-12-19T12:00:00Z",
@@ -180,24 +194,17 @@ class TestMCPTools:
         assert result["aggregation"] == "mean"
     
     @pytest.mark.asyncio
-    async def test_get_history_with_database(self, mock_db_pool, mock_connection, sample_entity_data, sample_history_data):
+    async def test_get_history_with_database(self, mock_db_pool, mock_connection, sample_entity_data):
         """Test get_history with database connection"""
         server.db_pool = mock_db_pool
-        mock_db_pool.acquire.return_value.__aenter__ = AsyncMock(return_value=mock_connection)
-        mock_db_pool.acquire.return_value.__aexit__ = AsyncMock()
         
-        # Mock entity metadata query
-        mock_connection.fetchrow = AsyncMock(side_effect=[
-            {"metadata_id": 123, "entity_id": "sensor.temperature"},  # Entity exists
-        ])
+        # Mock entity metadata query; the entity exists
+        mock_connection.fetchrow = AsyncMock(return_value=ENTITY_META)
         
         # Mock history data query
-        mock_connection.fetch = AsyncMock(return_value=[
-            {"timestamp": item["timestamp"], "value": float(item["state"])}
-            for item in sample_history_data
-        ])
+        mock_connection.fetch = AsyncMock(return_value=HISTORY_ROWS)
         
-        result = await server.get_history(
+        result = await server.HAMCPServer().get_history(
             entity_id="sensor.temperature",
             start="2024-12-19T00:00:00Z",
             end="2024-12-19T12:00:00Z",
@@ -207,47 +214,58 @@ class TestMCPTools:
         
         assert result["entity_id"] == "sensor.temperature"
         assert "error" not in result
-        assert isinstance(result["series"], list)
+        assert result["count"] == 12
+        assert [point["t"] for point in result["series"]] == [
+            datetime(2024, 12, 19, hour, tzinfo=timezone.utc) for hour in range(12)
+        ]
+        # Float states pass through as the values, without a str -> float cast
+        assert [point["v"] for point in result["series"]] == [item["state"] for item in SAMPLE_HISTORY]
+        assert all(type(point["v"]) is float for point in result["series"])
+        
+        # The history query runs for the metadata_id of the looked-up entity
+        mock_connection.fetchrow.assert_awaited_once_with(server.ENTITY_META_SQL, "sensor.temperature")
+        query, bucket_seconds, metadata_id, *_ = mock_connection.fetch.await_args.args
+        assert query == server.HISTORY_AGG_SQL["mean"]
+        assert (bucket_seconds, metadata_id) == (3600, ENTITY_META["metadata_id"])
     
     @pytest.mark.asyncio
     async def test_get_history_entity_not_found(self, mock_db_pool, mock_connection):
         """Test get_history when entity doesn't exist"""
         server.db_pool = mock_db_pool
-        mock_db_pool.acquire.return_value.__aenter__ = AsyncMock(return_value=mock_connection)
-        mock_db_pool.acquire.return_value.__aexit__ = AsyncMock()
         
         # Entity not found
         mock_connection.fetchrow = AsyncMock(return_value=None)
         
-        result = await server.get_history(
+        result = await server.HAMCPServer().get_history(
             entity_id="sensor.nonexistent",
             start="2024-12-19T00:00:00Z",
             end="2024-12-19T12:00:00Z"
         )
         
         assert result["entity_id"] == "sensor.nonexistent"
-        assert result["error"] == "Entity not found"
+        assert result["error"] == "Entity 'sensor.nonexistent' not found in database"
         assert result["series"] == []
+        mock_connection.fetch.assert_not_awaited()
     
     @pytest.mark.asyncio
     async def test_get_history_date_range_validation(self):
         """Test date range validation in get_history"""
         server.db_pool = None
         
-        # Test exceeding max days
-        with pytest.raises(ValueError, match="Query range exceeds"):
-            await server.get_history(
-                entity_id="sensor.test",
-                start="2024-01-01T00:00:00Z",
-                end="2024-12-31T00:00:00Z"  # Almost a year
-            )
+        # Test exceeding max days; the error is returned, not raised
+        result = await server.HAMCPServer().get_history(
+            entity_id="sensor.test",
+            start="2024-01-01T00:00:00Z",
+            end="2024-12-31T00:00:00Z"  # Almost a year
+        )
+        assert f"Query range exceeds {server.MAX_QUERY_DAYS} days" in result["error"]
     
     @pytest.mark.asyncio
     async def test_get_statistics_no_database(self):
         """Test get_statistics with no database"""
         server.db_pool = None
         
-        result = await server.get_statistics(
+        result = await server.HAMCPServer().get_statistics(
             statistic_id="sensor.test",
             start="2024-12-19T00:00:00Z",
             end="2024-12-19T12:00:00Z",
@@ -264,7 +282,7 @@ class TestMCPTools:
         """Test list_entities with no database"""
         server.db_pool = None
         
-        result = await server.list_entities(limit=10)
+        result = await server.HAMCPServer().list_entities(limit=10)
         
         assert result["mock_data"] is True
         assert len(result["entities"]) > 0
@@ -277,25 +295,133 @@ class TestMCPTools:
         """Test health_check with no database"""
         server.db_pool = None
         
-        result = await server.health_check()
+        await server.probe_database()
+        result = await server.HAMCPServer().health_check()
         
         assert result["status"] == "ok"
-        assert result["version"] == "0.5.0"
-        assert result["database"] == "disconnected"
-        assert result["read_only"] is True
+        assert result["version"] == "6.4"
+        assert result["database"]["status"] == "disconnected"
+        assert result["configuration"]["read_only"] is True
     
     @pytest.mark.asyncio
-    async def test_health_check_with_database(self, mock_db_pool, mock_connection):
+    async def test_health_check_with_database(self, mock_db_pool):
         """Test health_check with database"""
         server.db_pool = mock_db_pool
-        mock_db_pool.acquire.return_value.__aenter__ = AsyncMock(return_value=mock_connection)
-        mock_db_pool.acquire.return_value.__aexit__ = AsyncMock()
-        mock_connection.fetchval = AsyncMock(return_value=1)
+        mock_db_pool.fetchrow = AsyncMock(return_value=("PostgreSQL 14.5", False))
+        mock_db_pool.get_size = Mock(return_value=2)
+        mock_db_pool.get_idle_size = Mock(return_value=2)
         
-        result = await server.health_check()
+        await server.probe_database()
+        result = await server.HAMCPServer().health_check()
         
         assert result["status"] == "ok"
-        assert result["database"] == "healthy"
+        assert result["database"]["status"] == "healthy"
+        assert result["database"]["info"]["version"] == "PostgreSQL 14.5"
+        mock_db_pool.acquire.assert_not_called()  # The probe needs no explicit acquire
+
+class TestHistoryJson:
+    """Test the database-rendered JSON fast path of /history against get_history"""
+    
+    # Two raw rows, one with and one without a fractional second
+    RAW_ROWS = (
+        (datetime(2024, 12, 19, 0, 0, tzinfo=timezone.utc), 20.5),
+        (datetime(2024, 12, 19, 0, 30, 0, 120000, tzinfo=timezone.utc), 21.25),
+    )
+    # The same rows as PostgreSQL's json_agg renders them with HISTORY_RAW_JSON_SQL
+    RAW_JSON = (
+        '[{"t" : "2024-12-19T00:00:00Z", "v" : 20.5}, '
+        '{"t" : "2024-12-19T00:30:00.120000Z", "v" : 21.25}]'
+    )
+    RANGE = (datetime(2024, 12, 19, tzinfo=timezone.utc), datetime(2024, 12, 19, 1, tzinfo=timezone.utc))
+    
+    async def both_paths(self, entity_id):
+        """Parsed get_history_json and get_history results, without query_time"""
+        mcp_server = server.HAMCPServer()
+        fast = orjson.loads(await mcp_server.get_history_json(entity_id, *self.RANGE))
+        regular = orjson.loads(server.dumps(await mcp_server.get_history(entity_id, *self.RANGE, interval="raw")))
+        fast.pop("query_time", None)
+        regular.pop("query_time", None)
+        return fast, regular
+    
+    @pytest.mark.asyncio
+    async def test_history_json_matches_get_history(self, mock_db_pool, mock_connection):
+        """Test both paths return the same keys, order and timestamp format"""
+        server.db_pool = mock_db_pool
+        mock_connection.fetchrow = AsyncMock(side_effect=lambda query, *args: {
+            server.ENTITY_META_SQL: ENTITY_META,
+            server.HISTORY_RAW_JSON_SQL: {"metadata_id": 123, "count": 2, "series": self.RAW_JSON},
+        }[query])
+        mock_connection.fetch = AsyncMock(return_value=self.RAW_ROWS)
+        
+        fast, regular = await self.both_paths("sensor.temperature")
+        
+        assert list(fast) == list(regular)
+        assert fast == regular
+        assert fast["aggregation"] == "mean"
+        assert [point["t"] for point in fast["series"]] == ["2024-12-19T00:00:00Z", "2024-12-19T00:30:00.120000Z"]
+    
+    @pytest.mark.asyncio
+    async def test_history_json_unknown_entity(self, mock_db_pool, mock_connection):
+        """Test an unknown entity gets get_history's error without a second query"""
+        server.db_pool = mock_db_pool
+        mock_connection.fetchrow = AsyncMock(return_value={"metadata_id": None, "count": 0, "series": "[]"})
+        
+        body = await server.HAMCPServer().get_history_json("sensor.nonexistent", *self.RANGE)
+        
+        assert orjson.loads(body) == server.entity_not_found("sensor.nonexistent")
+        mock_connection.fetchrow.assert_awaited_once()
+    
+    @pytest.mark.asyncio
+    async def test_history_json_empty_range(self, mock_db_pool, mock_connection):
+        """Test a known entity without data returns an empty series from the fast path"""
+        server.db_pool = mock_db_pool
+        mock_connection.fetchrow = AsyncMock(side_effect=lambda query, *args: {
+            server.ENTITY_META_SQL: ENTITY_META,
+            server.HISTORY_RAW_JSON_SQL: {"metadata_id": 123, "count": 0, "series": "[]"},
+        }[query])
+        mock_connection.fetch = AsyncMock(return_value=[])
+        
+        fast, regular = await self.both_paths("sensor.temperature")
+        
+        assert fast == regular
+        assert fast["series"] == []
+    
+    @pytest.mark.asyncio
+    async def test_history_json_database_error(self, mock_db_pool, mock_connection):
+        """Test a failing database is reported once instead of queried again"""
+        server.db_pool = mock_db_pool
+        mock_connection.fetchrow = AsyncMock(side_effect=Exception("Database error"))
+        
+        body = await server.HAMCPServer().get_history_json("sensor.test", *self.RANGE)
+        
+        assert orjson.loads(body) == {
+            "entity_id": "sensor.test",
+            "error": "Database query failed: Database error",
+            "series": []
+        }
+        mock_connection.fetchrow.assert_awaited_once()
+    
+    @pytest.mark.asyncio
+    async def test_history_json_mixed_offsets(self, mock_db_pool, mock_connection):
+        """Test /history?interval=raw reads an offset-less bound as UTC next to a 'Z' bound"""
+        server.db_pool = mock_db_pool
+        server.mcp_server_instance = server.HAMCPServer()
+        mock_connection.fetchrow = AsyncMock(return_value={"metadata_id": 123, "count": 2, "series": self.RAW_JSON})
+        request = Request({"type": "http", "headers": []})
+        
+        response = await server.history_endpoint(
+            request, "sensor.temperature", "2024-12-19T00:00:00", "2024-12-19T01:00:00Z", interval="raw",
+            aggregation="mean", limit=server.MAX_RAW_ROWS, numeric=True, precision=None, time_format="iso", format=None
+        )
+        
+        assert orjson.loads(response.body)["count"] == 2
+        _, _, start_ts, end_ts, _ = mock_connection.fetchrow.await_args.args
+        assert (start_ts, end_ts) == tuple(bound.timestamp() for bound in self.RANGE)
+        
+        # Naive datetimes handed straight to the fast path are UTC as well
+        naive = tuple(bound.replace(tzinfo=None) for bound in self.RANGE)
+        await server.mcp_server_instance.get_history_json("sensor.temperature", *naive)
+        assert mock_connection.fetchrow.await_args.args[2:4] == (start_ts, end_ts)
 
 class TestEdgeCases:
     """Test edge cases and error handling"""
@@ -304,59 +430,668 @@ class TestEdgeCases:
     async def test_get_history_database_error(self, mock_db_pool, mock_connection):
         """Test database error handling in get_history"""
         server.db_pool = mock_db_pool
-        mock_db_pool.acquire.return_value.__aenter__ = AsyncMock(return_value=mock_connection)
-        mock_db_pool.acquire.return_value.__aexit__ = AsyncMock()
         mock_connection.fetchrow = AsyncMock(side_effect=Exception("Database error"))
         
-        result = await server.get_history(
+        result = await server.HAMCPServer().get_history(
             entity_id="sensor.test",
             start="2024-12-19T00:00:00Z",
             end="2024-12-19T12:00:00Z"
         )
         
-        assert "error" in result
-        assert "Database error" in result["error"]
+        assert result["error"] == "Database query failed: Database error"
+        assert result["series"] == []
     
     @pytest.mark.asyncio
     async def test_get_statistics_invalid_period(self):
         """Test get_statistics with different periods"""
         server.db_pool = None
+        mcp_server = server.HAMCPServer()
         
-        # Test 5minute period
-        result = await server.get_statistics(
-            statistic_id="sensor.test",
-            start="2024-12-19T00:00:00Z",
-            end="2024-12-19T01:00:00Z",
-            period="5minute"
+        # The 5minute and month queries are independent, so run them together
+        result_5m, result_month = await asyncio.gather(
+            mcp_server.get_statistics(
+                statistic_id="sensor.test",
+                start="2024-12-19T00:00:00Z",
+                end="2024-12-19T01:00:00Z",
+                period="5minute"
+            ),
+            mcp_server.get_statistics(
+                statistic_id="sensor.test",
+                start="2024-12-01T00:00:00Z",
+                end="2024-12-31T00:00:00Z",
+                period="month"
+            )
         )
-        assert result["period"] == "5minute"
+        assert result_5m["period"] == "5minute"
+        assert result_month["period"] == "month"
+    
+    @pytest.mark.asyncio
+    async def test_list_entities_with_limit(self, mock_db_pool):
+        """Test list_entities respects limit parameter"""
+        server.db_pool = mock_db_pool
         
-        # Test month period
-        result = await server.get_statistics(
-            statistic_id="sensor.test",
-            start="2024-12-01T00:00:00Z",
-            end="2024-12-31T00:00:00Z",
-            period="month"
+        # Entity query with 5 results, empty statistics; both run on the pool directly
+        ts = NOW.timestamp()
+        entity_rows = [{"entity_id": f"sensor.test_{i}", "last_seen_ts": ts} for i in range(5)]
+        mock_db_pool.fetch.side_effect = lambda query, *args: (
+            entity_rows if query == server.ENTITIES_SQL[False] else []
         )
-        assert result["period"] == "month"
+        
+        result = await server.HAMCPServer().list_entities(limit=5)
+        
+        assert len(result["entities"]) == 5
+        assert result["entities"][0]["last_seen"] == NOW
+        assert result["statistics"] == []
+        mock_db_pool.fetch.assert_any_await(server.ENTITIES_SQL[False], ANY, 5)
+        mock_db_pool.fetch.assert_any_await(server.STATISTICS_LIST_SQL[False], 5)
+
+class TestResponseFormats:
+    """Test the options shaping history and statistics results"""
+    
+    RANGE = ("2024-12-19T00:00:00Z", "2024-12-19T12:00:00Z")
+    
+    @pytest.fixture
+    def history_db(self, mock_db_pool, mock_connection):
+        """mock_db_pool answering the history query with HISTORY_ROWS at full float precision"""
+        mock_connection.fetchrow = AsyncMock(return_value=ENTITY_META)
+        mock_connection.fetch = AsyncMock(return_value=[(t, v + 1 / 3) for t, v in HISTORY_ROWS])
+        server.db_pool = mock_db_pool
+        return mock_connection
     
     @pytest.mark.asyncio
-    async def test_list_entities_with_limit(self, mock_db_pool, mock_connection):
-        """Test list_entities respects limit parameter"""
+    async def test_history_precision(self, history_db):
+        """Test precision rounds the values and leaves them full length without it"""
+        mcp_server = server.HAMCPServer()
+        
+        rounded = await mcp_server.get_history("sensor.temperature", *self.RANGE, precision=2)
+        full = await mcp_server.get_history("sensor.temperature", *self.RANGE)
+        
+        assert [point["v"] for point in rounded["series"]] == [
+            round(item["state"] + 1 / 3, 2) for item in SAMPLE_HISTORY
+        ]
+        assert [point["v"] for point in full["series"]] == [item["state"] + 1 / 3 for item in SAMPLE_HISTORY]
+    
+    @pytest.mark.asyncio
+    async def test_statistics_precision(self, mock_db_pool, mock_connection):
+        """Test precision rounds every statistics field present in a row"""
+        mock_connection.fetchrow = AsyncMock(
+            return_value={"id": 7, "source": "recorder", "unit_of_measurement": "°C"}
+        )
+        mock_connection.fetch = AsyncMock(return_value=[
+            (NOW, 21.23456, 20.98765, 22.55555, None),
+        ])
+        server.db_pool = mock_db_pool
+        
+        result = await server.HAMCPServer().get_statistics("sensor.temperature", *self.RANGE, precision=1)
+        
+        assert result["series"] == [{"t": NOW, "mean": 21.2, "min": 21.0, "max": 22.6}]
+    
+    @pytest.mark.asyncio
+    async def test_mock_history_precision(self):
+        """Test precision also applies to the mock series"""
+        server.db_pool = None
+        
+        result = await server.HAMCPServer().get_history("sensor.test", *self.RANGE, precision=0)
+        
+        assert all(point["v"] == round(point["v"]) for point in result["series"])
+    
+    async def history_response(self, accept="*/*", **params):
+        """/history response for the test range, called the way FastAPI would"""
+        server.mcp_server_instance = server.HAMCPServer()
+        request = Request({"type": "http", "headers": [(b"accept", accept.encode())]})
+        params = {"interval": "1h", "aggregation": "mean", "limit": server.MAX_RAW_ROWS, "numeric": True,
+                  "precision": None, "time_format": "iso", "format": None, **params}
+        return await server.history_endpoint(request, "sensor.temperature", *self.RANGE, **params)
+    
+    @pytest.mark.asyncio
+    async def test_history_msgpack_columnar(self, mock_db_pool, mock_connection):
+        """Test format=msgpack returns epoch seconds and values as two flat arrays"""
+        mock_connection.fetchrow = AsyncMock(return_value=ENTITY_META)
+        mock_connection.fetch = AsyncMock(return_value=HISTORY_ROWS)
+        server.db_pool = mock_db_pool
+        
+        response = await self.history_response(format="msgpack")
+        
+        assert response.media_type == "application/msgpack"
+        result = msgpack.unpackb(response.body)
+        assert result["t"] == [item["timestamp"] for item in SAMPLE_HISTORY]
+        assert result["v"] == [item["state"] for item in SAMPLE_HISTORY]
+        assert result["count"] == 12
+        assert result["time_range"] == {
+            "start": datetime(2024, 12, 19, tzinfo=timezone.utc).timestamp(),
+            "end": datetime(2024, 12, 19, 12, tzinfo=timezone.utc).timestamp(),
+        }
+        assert "series" not in result and "query_time" not in result
+    
+    @pytest.mark.asyncio
+    async def test_history_format_negotiation(self, history_db):
+        """Test the Accept header selects MessagePack unless format asks for JSON"""
+        negotiated = await self.history_response(accept="application/msgpack")
+        forced_json = await self.history_response(accept="application/msgpack", format="json")
+        
+        assert negotiated.media_type == "application/msgpack"
+        assert len(msgpack.unpackb(negotiated.body)["v"]) == 12
+        assert forced_json.media_type == "application/json"
+        assert len(orjson.loads(forced_json.body)["series"]) == 12
+    
+    @pytest.mark.asyncio
+    async def test_history_msgpack_error_is_json(self, mock_db_pool, mock_connection):
+        """Test errors are returned as JSON even when MessagePack was asked for"""
+        mock_connection.fetchrow = AsyncMock(return_value=None)
+        server.db_pool = mock_db_pool
+        
+        response = await self.history_response(format="msgpack")
+        
+        assert response.media_type == "application/json"
+        assert orjson.loads(response.body)["error"] == "Entity 'sensor.temperature' not found in database"
+    
+    @pytest.mark.asyncio
+    async def test_history_epoch_ms(self, history_db):
+        """Test time_format=epoch_ms replaces the point datetimes with integer milliseconds"""
+        result = await server.HAMCPServer().get_history("sensor.temperature", *self.RANGE, time_format="epoch_ms")
+        
+        assert [point["t"] for point in result["series"]] == [
+            int(item["timestamp"] * 1000) for item in SAMPLE_HISTORY
+        ]
+        assert all(type(point["t"]) is int for point in result["series"])
+    
+    @pytest.mark.asyncio
+    async def test_statistics_epoch_ms(self):
+        """Test time_format=epoch_ms applies to statistics, here from the mock series"""
+        server.db_pool = None
+        
+        result = await server.HAMCPServer().get_statistics("sensor.temperature", *self.RANGE, time_format="epoch_ms")
+        
+        assert result["series"][0]["t"] == int(datetime(2024, 12, 19, tzinfo=timezone.utc).timestamp() * 1000)
+        assert all(type(point["t"]) is int for point in result["series"])
+    
+    @pytest.mark.asyncio
+    async def test_history_endpoint_epoch_ms(self, history_db):
+        """Test /history honours epoch_ms for raw JSON and MessagePack instead of the ISO-only fast path"""
+        raw = await self.history_response(interval="raw", time_format="epoch_ms")
+        packed = await self.history_response(format="msgpack", time_format="epoch_ms")
+        
+        expected = [int(item["timestamp"] * 1000) for item in SAMPLE_HISTORY]
+        assert [point["t"] for point in orjson.loads(raw.body)["series"]] == expected
+        assert msgpack.unpackb(packed.body)["t"] == expected
+        assert server.HISTORY_RAW_JSON_SQL not in [call.args[0] for call in history_db.fetchrow.await_args_list]
+    
+    @pytest.mark.parametrize("end,bucket_seconds", [
+        ("2024-12-19T12:00:00Z", 216),  # 43200 s / 200 points
+        ("2024-12-19T00:10:00Z", 60),  # Never narrower than a minute
+        ("2025-03-19T00:00:00Z", 38880),  # 90 days / 200 points
+    ])
+    @pytest.mark.asyncio
+    async def test_history_auto_interval(self, history_db, end, bucket_seconds):
+        """Test interval=auto sizes the SQL buckets from the range and reports their width"""
+        result = await server.HAMCPServer().get_history(
+            "sensor.temperature", "2024-12-19T00:00:00Z", end, interval="auto"
+        )
+        
+        query, bound_seconds, *_ = history_db.fetch.await_args.args
+        assert (query, bound_seconds) == (server.HISTORY_AGG_SQL["mean"], bucket_seconds)
+        assert result["interval"] == "auto"
+        assert result["bucket_seconds"] == bucket_seconds
+    
+    @pytest.mark.asyncio
+    async def test_history_fixed_interval_has_no_bucket_seconds(self, history_db):
+        """Test bucket_seconds is only added for interval=auto"""
+        result = await server.HAMCPServer().get_history("sensor.temperature", *self.RANGE, interval="15m")
+        
+        assert history_db.fetch.await_args.args[1] == 900
+        assert "bucket_seconds" not in result
+
+class TestEntityCache:
+    """Test the list_entities result cache"""
+    
+    @pytest.fixture
+    def catalog_pool(self, mock_db_pool):
+        """mock_db_pool answering the catalogue queries; limit=1 waits for the returned event"""
+        release_slow = asyncio.Event()
+        
+        async def fetch(query, *args):
+            if query == server.ENTITIES_SQL[False]:
+                if args[1] == 1:
+                    await release_slow.wait()
+                return [{"entity_id": "sensor.temperature", "last_seen_ts": NOW.timestamp()}]
+            return []
+        
+        mock_db_pool.fetch.side_effect = fetch
+        server.db_pool = mock_db_pool
+        return release_slow
+    
+    @pytest.mark.asyncio
+    async def test_cache_hit_miss_and_expiry(self, catalog_pool, mock_db_pool):
+        """Test results are reused per (limit, entity_type) until they expire"""
+        mcp_server = server.HAMCPServer()
+        
+        first = await mcp_server.list_entities(limit=10)
+        assert await mcp_server.list_entities(limit=10) is first  # Hit
+        assert mock_db_pool.fetch.await_count == 2  # Entities and statistics, once
+        
+        await mcp_server.list_entities(limit=10, entity_type="sensor")  # Miss: other key
+        assert mock_db_pool.fetch.await_count == 4
+        
+        _, result = mcp_server._entities_cache[(10, None)]
+        mcp_server._entities_cache[(10, None)] = (0, result)  # Expired
+        assert await mcp_server.list_entities(limit=10) is not first
+        assert mock_db_pool.fetch.await_count == 6
+    
+    @pytest.mark.asyncio
+    async def test_cache_is_bounded(self, catalog_pool, monkeypatch):
+        """Test client-chosen keys cannot grow the cache without bound"""
+        monkeypatch.setattr(server, "ENTITY_CACHE_SIZE", 2)
+        mcp_server = server.HAMCPServer()
+        
+        for limit in (10, 20, 30):
+            await mcp_server.list_entities(limit=limit)
+        
+        assert list(mcp_server._entities_cache) == [(20, None), (30, None)]
+    
+    @pytest.mark.asyncio
+    async def test_cache_misses_run_per_key(self, catalog_pool, mock_db_pool):
+        """Test identical misses share one query and a slow key does not hold up others"""
+        mcp_server = server.HAMCPServer()
+        slow = [asyncio.create_task(mcp_server.list_entities(limit=1)) for _ in range(3)]
+        await asyncio.sleep(0)
+        
+        # Another key completes while the limit=1 query is still waiting
+        await asyncio.wait_for(mcp_server.list_entities(limit=2), timeout=1)
+        assert not any(task.done() for task in slow)
+        
+        catalog_pool.set()
+        results = await asyncio.gather(*slow)
+        assert results[0] is results[1] is results[2]
+        limits = [
+            call.args[2] for call in mock_db_pool.fetch.await_args_list
+            if call.args[0] == server.ENTITIES_SQL[False]
+        ]
+        assert limits == [1, 2]
+        assert server._inflight == {}
+
+class TestSingleFlight:
+    """Test concurrent identical queries share one execution"""
+    
+    QUERY = {
+        "entity_id": "sensor.temperature",
+        "start": "2024-12-19T00:00:00Z",
+        "end": "2024-12-19T12:00:00Z",
+    }
+    
+    @pytest.fixture
+    def slow_history(self, mock_db_pool, mock_connection):
+        """History query that waits for the returned event before answering"""
+        release = asyncio.Event()
+        
+        async def fetch(*args):
+            await release.wait()
+            return HISTORY_ROWS
+        
+        mock_connection.fetchrow = AsyncMock(return_value=ENTITY_META)
+        mock_connection.fetch = AsyncMock(side_effect=fetch)
         server.db_pool = mock_db_pool
-        mock_db_pool.acquire.return_value.__aenter__ = AsyncMock(return_value=mock_connection)
-        mock_db_pool.acquire.return_value.__aexit__ = AsyncMock()
-        
-        # Mock entity query with 5 results
-        mock_connection.fetch = AsyncMock(side_effect=[
-            [{"entity_id": f"sensor.test_{i}", "last_seen_ts": datetime.utcnow().timestamp()} 
-             for i in range(5)],
-            []  # Empty statistics
+        return release
+    
+    @pytest.mark.asyncio
+    async def test_identical_calls_query_once(self, slow_history, mock_connection):
+        """Test concurrent identical get_history calls run one query and get one result"""
+        mcp_server = server.HAMCPServer()
+        callers = [asyncio.create_task(mcp_server.get_history(**self.QUERY)) for _ in range(5)]
+        await asyncio.sleep(0)
+        assert len(server._inflight) == 1
+        
+        slow_history.set()
+        results = await asyncio.gather(*callers)
+        
+        assert all(result is results[0] for result in results)
+        assert results[0]["count"] == 12
+        mock_connection.fetchrow.assert_awaited_once()
+        mock_connection.fetch.assert_awaited_once()
+        assert server._inflight == {}
+    
+    @pytest.mark.asyncio
+    async def test_different_arguments_query_separately(self, slow_history, mock_connection):
+        """Test calls differing in any argument, defaults included, do not share a query"""
+        mcp_server = server.HAMCPServer()
+        slow_history.set()
+        
+        await asyncio.gather(
+            mcp_server.get_history(**self.QUERY),
+            mcp_server.get_history(**self.QUERY, interval="1h"),  # Same as the default
+            mcp_server.get_history(**self.QUERY, aggregation="max"),
+        )
+        
+        assert mock_connection.fetch.await_count == 2
+        assert server._inflight == {}
+    
+    @pytest.mark.asyncio
+    async def test_cancelled_caller_does_not_cancel_others(self, slow_history, mock_connection):
+        """Test a caller going away leaves the shared query running for the rest"""
+        mcp_server = server.HAMCPServer()
+        callers = [asyncio.create_task(mcp_server.get_history(**self.QUERY)) for _ in range(3)]
+        await asyncio.sleep(0)
+        
+        callers[0].cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await callers[0]
+        assert len(server._inflight) == 1
+        
+        slow_history.set()
+        results = await asyncio.gather(*callers[1:])
+        
+        assert results[0] is results[1]
+        assert results[0]["count"] == 12
+        mock_connection.fetch.assert_awaited_once()
+        assert server._inflight == {}
+    
+    @pytest.mark.asyncio
+    async def test_failed_query_is_not_reused(self, slow_history, mock_connection):
+        """Test a failing query reaches every waiting caller and the next call runs afresh"""
+        mcp_server = server.HAMCPServer()
+        mock_connection.fetchrow = AsyncMock(side_effect=[asyncpg.PostgresError("boom"), ENTITY_META])
+        slow_history.set()
+        
+        results = await asyncio.gather(*(mcp_server.get_history(**self.QUERY) for _ in range(3)))
+        assert all(result["error"] == "Database query failed: boom" for result in results)
+        assert server._inflight == {}
+        
+        assert (await mcp_server.get_history(**self.QUERY))["count"] == 12
+        assert mock_connection.fetchrow.await_count == 2
+
+class TestStateNotifications:
+    """Test state change notifications and the LISTEN connection"""
+    
+    def test_broadcast_skips_full_client_queue(self, monkeypatch):
+        """Test a client that stops reading neither blocks nor breaks the others"""
+        stalled, reading = asyncio.Queue(maxsize=1), asyncio.Queue(maxsize=8)
+        stalled.put_nowait(b"old frame")
+        monkeypatch.setattr(server, "connected_clients", {"stalled": stalled, "reading": reading})
+        
+        server.on_state_notify(None, 1, server.STATE_NOTIFY_CHANNEL, '{"entity_id": "sensor.temperature"}')
+        server.broadcast_frame(b"ping")
+        
+        assert stalled.get_nowait() == b"old frame" and stalled.empty()
+        frame = reading.get_nowait()
+        assert orjson.loads(frame[len(b"data: "):]) == {
+            "jsonrpc": "2.0",
+            "method": "notifications/state_changed",
+            "params": {"entity_id": "sensor.temperature"}
+        }
+        assert reading.get_nowait() == b"ping"
+    
+    @pytest.mark.asyncio
+    async def test_shutdown_survives_dead_listen_connection(self, mock_db_pool, monkeypatch):
+        """Test a failing UNLISTEN still releases the connection and closes the pool"""
+        dead = AsyncMock()
+        dead.remove_listener.side_effect = ConnectionError("connection lost")
+        monkeypatch.setattr(server, "notify_conn", dead)
+        server.db_pool = mock_db_pool
+        
+        await server.shutdown_event()
+        
+        mock_db_pool.release.assert_awaited_once_with(dead)
+        mock_db_pool.close.assert_awaited_once()
+        assert server.notify_conn is None
+        assert server.db_pool is None
+    
+    @pytest.mark.asyncio
+    async def test_listen_again_after_connection_loss(self, mock_db_pool, monkeypatch):
+        """Test a LISTEN connection the pool took back after it died is replaced"""
+        dead = AsyncMock()
+        dead.is_closed = Mock(side_effect=asyncpg.InterfaceError("connection has been released back to the pool"))
+        fresh = AsyncMock()
+        fresh.is_closed = Mock(return_value=False)
+        mock_db_pool.acquire = AsyncMock(return_value=fresh)
+        monkeypatch.setattr(server, "notify_conn", dead)
+        server.db_pool = mock_db_pool
+        
+        await server.ensure_state_listener()
+        
+        assert server.notify_conn is fresh
+        fresh.add_listener.assert_awaited_once_with(server.STATE_NOTIFY_CHANNEL, server.on_state_notify)
+        
+        # A live connection is kept
+        await server.ensure_state_listener()
+        mock_db_pool.acquire.assert_awaited_once()
+
+class TestHistoryExport:
+    """Test the CSV export route fed by COPY ... TO STDOUT"""
+    
+    @pytest.fixture
+    def copy_tasks(self, mock_db_pool, mock_connection):
+        """Wire mock_db_pool for /history/export; collects the tasks running the COPY"""
+        tasks = []
+        
+        async def copy_from_query(query, *args, output, format, header):
+            tasks.append(asyncio.current_task())
+            await output(b"timestamp,state\n")
+            for i in range(mock_connection.copy_rows):
+                await output(f"2024-12-19T{i % 24:02d}:00:00Z,{20 + i}\n".encode())
+        
+        mock_db_pool.fetchrow = AsyncMock(return_value=ENTITY_META)
+        mock_connection.copy_from_query = copy_from_query
+        mock_connection.copy_rows = 3
+        server.db_pool = mock_db_pool
+        return tasks
+    
+    async def export(self):
+        """Body iterator of an export of the test day"""
+        response = await server.history_export_endpoint(
+            "sensor.temperature", "2024-12-19T00:00:00Z", "2024-12-20T00:00:00Z"
+        )
+        assert response.media_type == "text/csv"
+        return response.body_iterator
+    
+    @pytest.mark.asyncio
+    async def test_export_csv(self, copy_tasks):
+        """Test the export streams the COPY output in order"""
+        body = b"".join([chunk async for chunk in await self.export()])
+        
+        assert body == (
+            b"timestamp,state\n"
+            b"2024-12-19T00:00:00Z,20\n"
+            b"2024-12-19T01:00:00Z,21\n"
+            b"2024-12-19T02:00:00Z,22\n"
+        )
+        assert copy_tasks[0].done()
+    
+    @pytest.mark.asyncio
+    async def test_export_aborted_download_ends_copy(self, copy_tasks, mock_connection):
+        """Test a client that disconnects mid-download leaves no COPY task behind"""
+        mock_connection.copy_rows = 100  # More than the chunk queue holds
+        chunks = await self.export()
+        
+        assert await chunks.__anext__() == b"timestamp,state\n"
+        await asyncio.sleep(0.01)  # Let the COPY fill the queue and block
+        await chunks.aclose()  # What the server does when the client goes away
+        
+        await asyncio.wait(copy_tasks, timeout=1)
+        assert copy_tasks[0].done()
+    
+    @pytest.mark.asyncio
+    async def test_export_copy_error(self, copy_tasks, mock_connection):
+        """Test a failing COPY ends the download with its error instead of a truncated file"""
+        mock_connection.copy_from_query = AsyncMock(side_effect=asyncpg.PostgresError("COPY failed"))
+        
+        with pytest.raises(asyncpg.PostgresError, match="COPY failed"):
+            async for _ in await self.export():
+                pass
+    
+    @pytest.mark.asyncio
+    async def test_export_mixed_offsets(self, copy_tasks, mock_connection):
+        """Test a bound without an offset is read as UTC next to a 'Z' bound"""
+        mock_connection.copy_from_query = AsyncMock()
+        response = await server.history_export_endpoint(
+            "sensor.temperature", "2024-12-19T00:00:00", "2024-12-19T06:00:00Z"
+        )
+        async for _ in response.body_iterator:
+            pass
+        
+        _, _, start_ts, end_ts = mock_connection.copy_from_query.await_args.args
+        assert (start_ts, end_ts) == (
+            datetime(2024, 12, 19, tzinfo=timezone.utc).timestamp(),
+            datetime(2024, 12, 19, 6, tzinfo=timezone.utc).timestamp(),
+        )
+
+class TestHistoryStream:
+    """Test the cursor-fed /history/stream route"""
+    
+    @pytest.fixture
+    def cursor_rows(self, mock_db_pool, mock_connection, monkeypatch):
+        """Wire mock_db_pool for /history/stream; the returned list holds the rows the cursor yields"""
+        rows = list(HISTORY_ROWS)
+        
+        async def cursor(query, *args, prefetch):
+            for row in rows:
+                yield row
+        
+        monkeypatch.setattr(server, "STREAM_FETCH_SIZE", 5)
+        mock_db_pool.fetchrow = AsyncMock(return_value=ENTITY_META)
+        mock_connection.transaction = MagicMock()  # Async context manager
+        mock_connection.cursor = Mock(side_effect=cursor)
+        server.db_pool = mock_db_pool
+        return rows
+    
+    async def stream(self, **params):
+        """Chunks streamed for the test range"""
+        response = await server.history_stream_endpoint(
+            "sensor.temperature", "2024-12-19T00:00:00Z", "2024-12-19T12:00:00Z", **params
+        )
+        return response, [chunk async for chunk in response.body_iterator]
+    
+    @pytest.mark.asyncio
+    async def test_stream_json_array(self, cursor_rows, mock_connection):
+        """Test the rows arrive as one JSON array, a chunk per fetch, from a cursor in a transaction"""
+        response, chunks = await self.stream()
+        
+        assert response.media_type == "application/json"
+        assert len(chunks) == 5  # "[", batches of 5, 5 and 2, "]"
+        assert orjson.loads(b"".join(chunks)) == orjson.loads(server.dumps(
+            [{"t": t, "v": v} for t, v in HISTORY_ROWS]
+        ))
+        query, metadata_id, _, _, limit = mock_connection.cursor.call_args.args
+        assert (query, metadata_id, limit) == (server.HISTORY_RAW_SQL, ENTITY_META["metadata_id"], None)
+        assert mock_connection.cursor.call_args.kwargs == {"prefetch": 5}
+        mock_connection.transaction.return_value.__aenter__.assert_awaited_once()
+    
+    @pytest.mark.asyncio
+    async def test_stream_ndjson_states(self, cursor_rows, mock_connection):
+        """Test NDJSON puts one point per line and numeric=False keeps non-numeric states"""
+        cursor_rows[:] = [(NOW, "21.5"), (NOW, "unavailable")]
+        
+        response, chunks = await self.stream(numeric=False, format="ndjson")
+        
+        assert response.media_type == "application/x-ndjson"
+        assert [orjson.loads(line)["v"] for line in b"".join(chunks).splitlines()] == [21.5, "unavailable"]
+        assert mock_connection.cursor.call_args.args[0] == server.HISTORY_RAW_STATE_SQL
+    
+    @pytest.mark.asyncio
+    async def test_stream_empty_range(self, cursor_rows):
+        """Test a range without rows streams an empty array"""
+        cursor_rows.clear()
+        
+        _, chunks = await self.stream()
+        
+        assert orjson.loads(b"".join(chunks)) == []
+    
+    @pytest.mark.asyncio
+    async def test_stream_rejected_before_streaming(self, cursor_rows, mock_db_pool):
+        """Test unknown entities and a missing database fail with a status instead of a broken stream"""
+        mock_db_pool.fetchrow = AsyncMock(return_value=None)
+        with pytest.raises(server.HTTPException) as not_found:
+            await self.stream()
+        assert not_found.value.status_code == 404
+        
+        server.db_pool = None
+        with pytest.raises(server.HTTPException) as unavailable:
+            await self.stream()
+        assert unavailable.value.status_code == 503
+    
+    @pytest.mark.asyncio
+    async def test_stream_mixed_offsets(self, cursor_rows, mock_connection):
+        """Test a bound without an offset is read as UTC next to a 'Z' bound"""
+        response = await server.history_stream_endpoint(
+            "sensor.temperature", "2024-12-19T00:00:00", "2024-12-19T12:00:00Z"
+        )
+        assert len(orjson.loads(b"".join([chunk async for chunk in response.body_iterator]))) == 12
+        
+        _, _, start_ts, end_ts, _ = mock_connection.cursor.call_args.args
+        assert (start_ts, end_ts) == (
+            datetime(2024, 12, 19, tzinfo=timezone.utc).timestamp(),
+            NOW.timestamp(),
+        )
+        
+        with pytest.raises(server.HTTPException) as invalid:
+            await server.history_stream_endpoint("sensor.temperature", "yesterday", "2024-12-19T12:00:00Z")
+        assert invalid.value.status_code == 400
+
+class TestToolEndpoint:
+    """Test the /test-tool endpoint with single and batched calls"""
+    
+    @pytest.mark.asyncio
+    async def test_single_call(self):
+        """Test one call returns its result"""
+        server.db_pool = None
+        server.mcp_server_instance = server.HAMCPServer()
+        
+        response = await server.test_tool_call(server.ToolCall(tool="health_check"))
+        
+        body = orjson.loads(response.body)
+        assert body["success"] is True
+        assert body["result"]["database"]["status"] == "disconnected"
+    
+    @pytest.mark.asyncio
+    async def test_batch_results_in_order(self):
+        """Test a batch returns one result per call in order, failures included"""
+        server.db_pool = None
+        server.mcp_server_instance = server.HAMCPServer()
+        
+        response = await server.test_tool_call([
+            server.ToolCall(tool="health_check"),
+            server.ToolCall(tool="no_such_tool"),
+            server.ToolCall(tool="get_history", arguments={"entity_id": "sensor.test"}),  # Missing range
+            server.ToolCall(tool="get_history", arguments={
+                "entity_id": "sensor.test", "start": "2024-12-19T00:00:00Z", "end": "2024-12-19T06:00:00Z"
+            }),
         ])
         
-        result = await server.list_entities(limit=5)
+        body = orjson.loads(response.body)
+        assert body["success"] is True
+        health, unknown, failed, history = body["results"]
+        assert health["database"]["status"] == "disconnected"
+        assert unknown == {"error": "Unknown tool: no_such_tool"}
+        assert failed == {"error": "missing a required argument: 'start'"}
+        assert len(history["series"]) == 6
+    
+    @pytest.mark.asyncio
+    async def test_batch_runs_concurrently(self, monkeypatch):
+        """Test the calls of a batch overlap instead of running one after another"""
+        server.mcp_server_instance = server.HAMCPServer()
+        started, all_started = [], asyncio.Event()
         
-        assert len(result["entities"]) == 5
+        async def dispatch_tool(name, arguments):
+            started.append(name)
+            if len(started) == 3:
+                all_started.set()
+            await all_started.wait()  # Only returns once every call is running
+            return {"tool": name}
+        
+        monkeypatch.setattr(server.mcp_server_instance, "dispatch_tool", dispatch_tool)
+        
+        response = await asyncio.wait_for(
+            server.test_tool_call([server.ToolCall(tool="health_check")] * 3), timeout=1
+        )
+        
+        assert orjson.loads(response.body)["results"] == [{"tool": "health_check"}] * 3
+    
+    @pytest.mark.asyncio
+    async def test_not_initialized(self):
+        """Test calls before startup report the server is not ready"""
+        server.mcp_server_instance = None
+        
+        response = await server.test_tool_call([server.ToolCall()])
+        
+        assert orjson.loads(response.body) == {"success": False, "error": "MCP server not initialized"}
 
 # =============================================================================
 # Integration Tests
@@ -369,19 +1104,21 @@ class TestIntegration:
     async def test_full_workflow_mock_mode(self):
         """Test complete workflow in mock mode"""
         server.db_pool = None
+        await server.probe_database()
+        mcp_server = server.HAMCPServer()
         
-        # 1. Check health
-        health = await server.health_check()
+        # 1-2. Check health and list entities; neither depends on the other
+        health, entities = await asyncio.gather(
+            mcp_server.health_check(),
+            mcp_server.list_entities()
+        )
         assert health["status"] == "ok"
-        assert health["database"] == "disconnected"
-        
-        # 2. List entities
-        entities = await server.list_entities()
+        assert health["database"]["status"] == "disconnected"
         assert len(entities["entities"]) > 0
         entity_id = entities["entities"][0]["entity_id"]
         
         # 3. Get history for an entity
-        history = await server.get_history(
+        history = await mcp_server.get_history(
             entity_id=entity_id,
             start="2024-12-19T00:00:00Z",
             end="2024-12-19T06:00:00Z",
@@ -394,7 +1131,7 @@ class TestIntegration:
         # 4. Get statistics
         if entities["statistics"]:
             stat_id = entities["statistics"][0]["statistic_id"]
-            stats = await server.get_statistics(
+            stats = await mcp_server.get_statistics(
                 statistic_id=stat_id,
                 start="2024-12-19T00:00:00Z",
                 end="2024-12-19T06:00:00Z",
@@ -414,40 +1151,91 @@ class TestPerformance:
     async def test_concurrent_requests(self):
         """Test handling multiple concurrent requests"""
         server.db_pool = None
+        mcp_server = server.HAMCPServer()
         
-        # Create multiple concurrent requests
-        tasks = []
-        for i in range(10):
-            tasks.append(server.get_history(
-                entity_id=f"sensor.test_{i}",
-                start="2024-12-19T00:00:00Z",
-                end="2024-12-19T01:00:00Z",
-                interval="5m"
-            ))
-        
-        # Execute all tasks concurrently
-        results = await asyncio.gather(*tasks)
+        # Execute multiple requests concurrently
+        async with asyncio.TaskGroup() as tg:
+            tasks = [
+                tg.create_task(mcp_server.get_history(
+                    entity_id=f"sensor.test_{i}",
+                    start="2024-12-19T00:00:00Z",
+                    end="2024-12-19T01:00:00Z",
+                    interval="5m"
+                ))
+                for i in range(10)
+            ]
+        results = [task.result() for task in tasks]
         
         # Verify all completed successfully
         assert len(results) == 10
         assert all(r["entity_id"].startswith("sensor.test_") for r in results)
         assert all(r["mock_data"] is True for r in results)
     
+    @pytest.mark.asyncio
+    async def test_history_batch(self):
+        """Test querying several entities in one batch call"""
+        server.db_pool = None
+        entity_ids = [f"sensor.test_{i}" for i in range(10)]
+        
+        result = await server.HAMCPServer().get_history_batch(
+            entity_ids + ["sensor.test_0"],  # Duplicates are queried once
+            start="2024-12-19T00:00:00Z",
+            end="2024-12-19T01:00:00Z",
+            interval="5m"
+        )
+        
+        assert list(result["results"]) == entity_ids
+        assert result["entity_count"] == 10
+        assert all(r["entity_id"] == entity_id for entity_id, r in result["results"].items())
+        assert all(len(r["series"]) == 12 for r in result["results"].values())
+    
+    @pytest.mark.parametrize("entity_ids", [
+        "sensor.temperature",  # A lone id instead of a list
+        ["sensor.temperature", 42],
+        [],
+        [f"sensor.test_{i}" for i in range(21)],
+    ])
+    @pytest.mark.asyncio
+    async def test_history_batch_rejects_bad_entity_ids(self, entity_ids):
+        """Test anything but a list of 1 to 20 entity id strings is refused before querying"""
+        server.db_pool = None
+        
+        with patch.object(server.HAMCPServer, "get_history") as get_history:
+            result = await server.HAMCPServer().get_history_batch(
+                entity_ids, start="2024-12-19T00:00:00Z", end="2024-12-19T01:00:00Z"
+            )
+        
+        assert result == {"error": "entity_ids must list 1 to 20 entities"}
+        get_history.assert_not_called()
+    
     @pytest.mark.asyncio
     async def test_large_date_range(self):
         """Test handling large date ranges within limits"""
         server.db_pool = None
         
         # Test maximum allowed range (90 days by default)
-        result = await server.get_history(
+        result = await server.HAMCPServer().get_history(
             entity_id="sensor.test",
             start="2024-10-01T00:00:00Z",
-            end="2024-12-30T00:00:00Z",  # 89 days
+            end="2024-12-30T00:00:00Z",  # 90 days, the limit itself
             interval="1d"
         )
         
         assert result["entity_id"] == "sensor.test"
-        assert len(result["series"]) == 89
+        assert len(result["series"]) == 90
+    
+    @pytest.mark.skipif(importlib.util.find_spec("pytest_benchmark") is None, reason="pytest-benchmark not installed")
+    @pytest.mark.benchmark(group="mock_series")
+    def test_bench_mock_series_large(self, benchmark):
+        """Benchmark mock series generation over the maximum query range"""
+        mcp_server = server.HAMCPServer()
+        
+        series = benchmark(
+            mcp_server.generate_mock_series,
+            "2024-10-01T00:00:00Z", "2024-12-30T00:00:00Z", "1h"
+        )
+        
+        assert len(series) == server.MOCK_MAX_POINTS  # Capped series length
 
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])